@@ -8,56 +8,427 @@ import numpy as np
 from datetime import datetime
 import os
 import re
-from collections import Counter
+import copy
+import csv
+import hashlib
+import shutil
+import tempfile
+import threading
+import time
+import heapq
+import itertools
+import multiprocessing
+import secrets
+from multiprocessing import shared_memory
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, OrderedDict
+
+try:
+    import pyarrow  # noqa: F401 (motor opcional de leitura do CSV e do cache em Feather)
+    import pyarrow.feather
+    PYARROW_DISPONIVEL = True
+except ImportError:
+    PYARROW_DISPONIVEL = False
 
 # ============ FUNÇÕES DE PROCESSAMENTO MANUAIS ============
 
-def one_hot_encoding(df, columns):
-    """Implementação manual de One-Hot Encoding"""
-    result_df = df.copy()
+class MatrizEsparsaCSR:
+    """Implementação manual de matriz esparsa no formato CSR (linhas comprimidas)"""
+    def __init__(self, dados, indices, indptr, n_colunas, dtype=float):
+        self.dados = np.asarray(dados, dtype=dtype)     # Valores não nulos
+        self.indices = np.asarray(indices)              # Coluna de cada valor
+        self.indptr = np.asarray(indptr)                # Início de cada linha em dados/indices
+        self.n_colunas = n_colunas
+        # Linha de cada valor, usada para somar por linha com np.bincount
+        self.linhas_nnz = np.repeat(np.arange(len(self.indptr) - 1), np.diff(self.indptr))
     
-    for col in columns:
-        # Verificar se a coluna existe no DataFrame
-        if col not in df.columns:
-            continue
-            
-        # Obter valores únicos da coluna
-        unique_values = df[col].unique()
-        
-        # Criar colunas para cada valor único
-        for value in unique_values:
-            new_col_name = f"{col}_{value}"
-            result_df[new_col_name] = (df[col] == value).astype(int)
+    @property
+    def shape(self):
+        return (len(self.indptr) - 1, self.n_colunas)
+    
+    @property
+    def nbytes(self):
+        return self.dados.nbytes + self.indices.nbytes + self.indptr.nbytes + self.linhas_nnz.nbytes
+    
+    def _posicoes_linhas(self, linhas):
+        """Posições em dados/indices de todos os valores das linhas informadas"""
+        linhas = np.asarray(linhas)
+        inicios = self.indptr[linhas]
+        contagens = self.indptr[linhas + 1] - inicios
+        deslocamentos = np.arange(contagens.sum()) - np.repeat(np.cumsum(contagens) - contagens, contagens)
+        return np.repeat(inicios, contagens) + deslocamentos, contagens
+    
+    def produto_vetor(self, vetor, linhas=None):
+        """Produto matriz-vetor (opcionalmente só nas linhas informadas):
+        custo proporcional ao número de não nulos"""
+        if linhas is None:
+            return np.bincount(self.linhas_nnz, weights=self.dados * vetor[self.indices],
+                               minlength=self.shape[0])
+        posicoes, contagens = self._posicoes_linhas(linhas)
+        return np.bincount(np.repeat(np.arange(len(contagens)), contagens),
+                           weights=self.dados[posicoes] * vetor[self.indices[posicoes]],
+                           minlength=len(contagens))
+    
+    def produto_matriz(self, matriz):
+        """Produto por uma matriz densa (n_colunas x k): custo proporcional a nnz * k"""
+        contribuicoes = self.dados[:, None] * matriz[self.indices]
+        contagens = np.diff(self.indptr)
+        
+        # Linhas com o mesmo número de valores: soma direta por blocos
+        if len(contagens) and (contagens == contagens[0]).all():
+            return contribuicoes.reshape(self.shape[0], contagens[0], -1).sum(axis=1)
+        
+        resultado = np.zeros((self.shape[0], matriz.shape[1]))
+        nao_vazias = contagens > 0
+        if nao_vazias.any():
+            resultado[nao_vazias] = np.add.reduceat(contribuicoes, self.indptr[:-1][nao_vazias], axis=0)
+        return resultado
+    
+    def escalar_linhas(self, fatores):
+        """Nova matriz com cada linha multiplicada pelo fator correspondente"""
+        return MatrizEsparsaCSR(self.dados * fatores[self.linhas_nnz], self.indices,
+                                self.indptr, self.n_colunas, self.dados.dtype)
+    
+    def transposta(self):
+        """Transposta em CSR (ordena os valores por coluna)"""
+        ordem = np.argsort(self.indices, kind='stable')
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(self.indices, minlength=self.n_colunas))])
+        return MatrizEsparsaCSR(self.dados[ordem], self.linhas_nnz[ordem], indptr, self.shape[0],
+                                self.dados.dtype)
+
+def svd_truncado_aleatorio(matriz, n_fatores, n_iteracoes_potencia=2, sobreamostragem=10, semente=0):
+    """
+    SVD truncado aleatorizado (Halko et al.) de uma MatrizEsparsaCSR
+    Retorna (valores singulares, fatores das colunas: n_colunas x k)
+    """
+    transposta = matriz.transposta()
+    n_fatores = max(1, min(n_fatores, *matriz.shape))
+    rng = np.random.default_rng(semente)
+    
+    # Projeção em um subespaço aleatório pouco maior que n_fatores, refinada por
+    # iterações de potência; o SVD exato é só o da matriz pequena projetada
+    y = matriz.produto_matriz(rng.standard_normal((matriz.shape[1], min(n_fatores + sobreamostragem,
+                                                                        matriz.shape[1]))))
+    q, _ = np.linalg.qr(y)
+    for _ in range(n_iteracoes_potencia):
+        q, _ = np.linalg.qr(transposta.produto_matriz(q))
+        q, _ = np.linalg.qr(matriz.produto_matriz(q))
     
-    # Remover colunas originais
-    result_df = result_df.drop(columns=[col for col in columns if col in result_df.columns])
-    return result_df
+    # B = Q^T A, calculada como (A^T Q)^T
+    _, valores_singulares, vt = np.linalg.svd(transposta.produto_matriz(q).T, full_matrices=False)
+    return valores_singulares[:n_fatores], vt[:n_fatores].T
 
-def min_max_scaler(data):
-    """Implementação manual do MinMaxScaler"""
+def min_max_scaler(data, mascara=None):
+    """Implementação manual do MinMaxScaler (mínimo e máximo só das linhas de `mascara`, se houver)"""
     data = np.array(data).reshape(-1, 1)
-    min_val = np.min(data)
-    max_val = np.max(data)
+    referencia = data if mascara is None else data[np.asarray(mascara, dtype=bool)]
+    if referencia.size == 0:
+        return np.zeros(len(data))
+    min_val = np.min(referencia)
+    max_val = np.max(referencia)
     
     if max_val == min_val:  # Evitar divisão por zero
-        return np.zeros_like(data)
+        return np.zeros(len(data))
     
     scaled = (data - min_val) / (max_val - min_val)
     return scaled.flatten()
 
-def cosine_similarity_manual(vec1, vec2):
-    """Implementação manual da similaridade do cosseno"""
-    vec1 = np.array(vec1)
-    vec2 = np.array(vec2)
+def hash_arquivo(caminho, tamanho_bloco=1 << 20):
+    """Hash SHA-256 do conteúdo de um arquivo, lido em blocos"""
+    sha = hashlib.sha256()
+    with open(caminho, 'rb') as arquivo:
+        for bloco in iter(lambda: arquivo.read(tamanho_bloco), b''):
+            sha.update(bloco)
+    return sha.hexdigest()
+
+def hash_screeners(caminhos, diretorio=None):
+    """
+    Hash do conteúdo de um ou vários screeners (lista ou dict {bolsa: caminho})
+    Com `diretorio`, usa hash_arquivo_memorizado (tamanho e mtime)
+    """
+    calcular = hash_arquivo if diretorio is None else (lambda caminho: hash_arquivo_memorizado(caminho, diretorio))
+    # Um único arquivo tem o próprio hash: snapshots e caches antigos continuam valendo
+    if isinstance(caminhos, str):
+        return calcular(caminhos)
+    itens = caminhos.items() if isinstance(caminhos, dict) else ((None, caminho) for caminho in caminhos)
+    sha = hashlib.sha256()
+    for bolsa, caminho in itens:
+        sha.update(f"{bolsa}:{calcular(caminho)}\n".encode('utf-8'))
+    return sha.hexdigest()
+
+def gravar_atomico(destino, gravar):
+    """
+    Chama gravar(caminho_temporario) na mesma pasta de `destino` e renomeia
+    no final: quem lê `destino` vê o arquivo antigo ou o novo, nunca metade
+    """
+    diretorio = os.path.dirname(destino) or '.'
+    os.makedirs(diretorio, exist_ok=True)
+    descritor, temporario = tempfile.mkstemp(prefix='.tmp-', dir=diretorio)
+    os.close(descritor)
+    try:
+        gravar(temporario)
+        os.replace(temporario, destino)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+
+def hash_arquivo_memorizado(caminho, diretorio):
+    """
+    Hash SHA-256 do arquivo, memorizado em `diretorio` pelo tamanho e mtime:
+    enquanto os dois não mudarem, o arquivo não é relido
+    """
+    info = os.stat(caminho)
+    chave = {'caminho': os.path.abspath(caminho), 'tamanho': info.st_size, 'mtime_ns': info.st_mtime_ns}
+    nome = hashlib.sha256(chave['caminho'].encode('utf-8')).hexdigest()[:16]
+    caminho_chave = os.path.join(diretorio, f"hash-{nome}.json")
+    try:
+        with open(caminho_chave, encoding='utf-8') as arquivo:
+            memorizado = json.load(arquivo)
+        if all(memorizado.get(campo) == valor for campo, valor in chave.items()):
+            return memorizado['hash']
+    except (OSError, ValueError, KeyError):
+        pass
     
-    dot_product = np.dot(vec1, vec2)
-    norm_vec1 = np.linalg.norm(vec1)
-    norm_vec2 = np.linalg.norm(vec2)
+    chave['hash'] = hash_arquivo(caminho)
+    def gravar(temporario):
+        with open(temporario, 'w', encoding='utf-8') as arquivo:
+            json.dump(chave, arquivo)
+    try:
+        gravar_atomico(caminho_chave, gravar)
+    except OSError:
+        pass    # Pasta só de leitura: o hash vale, só não fica memorizado
+    return chave['hash']
+
+# Colunas lidas do screener e seus tipos; 'Last Sale' e '% Change' chegam
+# como texto ('$141.10', '1.038%') e são convertidas depois, numa passada
+COLUNAS_SCREENER = {
+    'Symbol': object,
+    'Name': object,
+    'Last Sale': object,
+    'Net Change': np.float64,
+    '% Change': object,
+    'Market Cap': np.float64,
+    'Country': object,
+    'IPO Year': np.float64,
+    'Volume': np.float64,
+    'Sector': object,
+    'Industry': object,
+    'Exchange': object
+}
+COLUNAS_FORMATADAS = ['Last Sale', '% Change']
+
+# Variantes de nome de coluna em exportações de outras bolsas/versões do
+# screener, comparadas sem maiúsculas, espaços e pontuação (exceto '%')
+VARIANTES_COLUNAS_SCREENER = {
+    'ticker': 'Symbol',
+    'companyname': 'Name',
+    'lastsale': 'Last Sale',
+    'lastprice': 'Last Sale',
+    'price': 'Last Sale',
+    'netchange': 'Net Change',
+    'netchg': 'Net Change',
+    '%change': '% Change',
+    '%chg': '% Change',
+    'pctchange': '% Change',
+    'marketcap': 'Market Cap',
+    'ipoyear': 'IPO Year',
+    'industry': 'Industry',
+    'sector': 'Sector',
+    'country': 'Country',
+    'volume': 'Volume',
+    'exchange': 'Exchange'
+}
+BOLSAS_CONHECIDAS = ('NASDAQ', 'NYSE', 'AMEX')
+
+def _coluna_canonica(coluna):
+    """Nome de COLUNAS_SCREENER correspondente a `coluna` (ou None se não for usada)"""
+    if coluna in COLUNAS_SCREENER:
+        return coluna
+    chave = re.sub(r'[^a-z0-9%]', '', str(coluna).lower())
+    for nome in COLUNAS_SCREENER:
+        if re.sub(r'[^a-z0-9%]', '', nome.lower()) == chave:
+            return nome
+    return VARIANTES_COLUNAS_SCREENER.get(chave)
+
+def converter_numerico(serie):
+    """Converte texto com '$', '%', vírgulas ou espaços em número (inválidos viram NaN)"""
+    if pd.api.types.is_numeric_dtype(serie):
+        return serie.astype(float)
+    valores = serie.to_numpy(dtype=object)
+    ausentes = pd.isna(valores)
+    numeros = None
+    if hasattr(np, 'strings'):
+        # NumPy 2: strip e conversão em laços nativos, sem objetos Python por valor
+        try:
+            texto = np.where(ausentes, 'nan', valores).astype(np.dtypes.StringDType())
+            numeros = np.strings.strip(texto, '$% ').astype(float)
+        except (TypeError, ValueError):
+            numeros = None
+    if numeros is None:
+        numeros = np.array(pd.to_numeric(serie.str.strip('$% '), errors='coerce'), dtype=float)
+    # Só o que ainda não virou número (separador de milhar, não texto) passa pela regex
+    restantes = np.isnan(numeros) & ~ausentes
+    if restantes.any():
+        numeros[restantes] = pd.to_numeric(
+            serie[restantes].astype(str).str.replace(r'[$%,\s]', '', regex=True), errors='coerce')
+    return pd.Series(numeros, index=serie.index, name=serie.name)
+
+def carregar_screener(caminho, usar_pyarrow=None):
+    """
+    Lê o CSV do screener com colunas e tipos declarados (motor pyarrow quando disponível)
+    Retorna (DataFrame, relatório de rejeitados: linha, Symbol, coluna, valor, motivo)
+    """
+    # Cabeçalho: nome no arquivo -> nome canônico (a primeira variante encontrada vale)
+    with open(caminho, newline='', encoding='utf-8-sig') as arquivo:
+        cabecalho = next(csv.reader(arquivo), [])
+    nomes = {}
+    for coluna in cabecalho:
+        canonica = _coluna_canonica(coluna)
+        if canonica is not None and canonica not in nomes.values():
+            nomes[coluna] = canonica
+    # Só vazio conta como ausente: o ticker "NA" continua sendo um símbolo
+    parametros = dict(usecols=list(nomes), keep_default_na=False, na_values=[''])
+    tipos = {coluna: COLUNAS_SCREENER[canonica] for coluna, canonica in nomes.items()}
     
-    if norm_vec1 == 0 or norm_vec2 == 0:
-        return 0
+    df, motor = None, 'c'
+    if usar_pyarrow or (usar_pyarrow is None and PYARROW_DISPONIVEL):
+        try:
+            df = pd.read_csv(caminho, engine='pyarrow', dtype=tipos, **parametros)
+            motor = 'pyarrow'
+        except (ImportError, TypeError, ValueError) as e:
+            print(f"⚠️ Leitura com pyarrow falhou ({e}), usando o motor padrão")
+    if df is None:
+        try:
+            df = pd.read_csv(caminho, dtype=tipos, **parametros)
+        except ValueError:
+            # Texto em coluna numérica: lê tudo como texto e converte com relatório
+            df = pd.read_csv(caminho, dtype=object, **parametros)
+    df = df.rename(columns=nomes)
+    colunas = list(df.columns)
+    
+    # Inválidos viram NaN; ausentes de preço/variação ficam (o pré-processamento
+    # preenche com 0), mas os dois vão para o relatório
+    partes = []
+    def registrar(mascara, coluna, motivo):
+        if mascara.any():
+            partes.append(pd.DataFrame({
+                'linha': df.index[mascara] + 2,      # +1 do cabeçalho, +1 da contagem a partir de 1
+                'Symbol': df['Symbol'][mascara] if 'Symbol' in df.columns else None,
+                'coluna': coluna,
+                'valor': df[coluna][mascara].astype(str),
+                'motivo': motivo
+            }))
     
-    return dot_product / (norm_vec1 * norm_vec2)
+    for col in colunas:
+        if pd.api.types.is_numeric_dtype(df[col]) or (COLUNAS_SCREENER[col] is object
+                                                      and col not in COLUNAS_FORMATADAS):
+            continue
+        convertido = converter_numerico(df[col])
+        registrar((df[col].notna() & convertido.isna()).to_numpy(), col, 'valor inválido')
+        if col in COLUNAS_FORMATADAS:
+            registrar(df[col].isna().to_numpy(), col, 'ausente')
+        df[col] = convertido
+    
+    if 'Symbol' in df.columns:
+        simbolos = df['Symbol'].str.strip()
+        df['Symbol'] = simbolos.where(simbolos != '')
+        sem_simbolo = df['Symbol'].isna().to_numpy()
+        repetidos = (df['Symbol'].duplicated() & ~df['Symbol'].isna()).to_numpy()
+        registrar(sem_simbolo, 'Symbol', 'símbolo ausente (linha descartada)')
+        registrar(repetidos, 'Symbol', 'símbolo repetido (linha descartada)')
+        df = df[~(sem_simbolo | repetidos)].reset_index(drop=True)
+    
+    relatorio = (pd.concat(partes, ignore_index=True).sort_values('linha', kind='stable', ignore_index=True)
+                 if partes else pd.DataFrame(columns=['linha', 'Symbol', 'coluna', 'valor', 'motivo']))
+    print(f"📋 Screener lido ({motor}): {len(df)} ativos, {len(relatorio)} valores rejeitados")
+    return df, relatorio
+
+def bolsa_do_arquivo(caminho):
+    """Bolsa de um screener pelo nome do arquivo ('nyse_screener.csv' -> 'NYSE')"""
+    nome = os.path.splitext(os.path.basename(caminho))[0].upper()
+    return next((bolsa for bolsa in BOLSAS_CONHECIDAS if bolsa in nome), nome)
+
+def carregar_screeners(caminhos, n_threads=None, usar_pyarrow=None):
+    """
+    Lê vários screeners (lista, dict {bolsa: caminho} ou um caminho) em paralelo e junta em um só universo
+    Retorna (DataFrame, relatório com a coluna Exchange de cada rejeição)
+    """
+    if isinstance(caminhos, str):
+        caminhos = [caminhos]
+    if not isinstance(caminhos, dict):
+        caminhos = {bolsa_do_arquivo(caminho): caminho for caminho in caminhos}
+    
+    n_threads = max(1, min(len(caminhos), n_threads or os.cpu_count() or 1))
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        lidos = list(executor.map(lambda caminho: carregar_screener(caminho, usar_pyarrow),
+                                  caminhos.values()))
+    
+    partes, relatorios = [], []
+    for bolsa, (df, relatorio) in zip(caminhos, lidos):
+        if 'Exchange' in df.columns:
+            df['Exchange'] = df['Exchange'].fillna(bolsa)
+        else:
+            df['Exchange'] = bolsa
+        partes.append(df)
+        relatorios.append(relatorio.assign(Exchange=bolsa))
+    universo = pd.concat(partes, ignore_index=True)
+    
+    # Símbolo em mais de uma bolsa: vale a primeira
+    repetidos = universo['Symbol'].duplicated().to_numpy()
+    if repetidos.any():
+        relatorios.append(pd.DataFrame({
+            'linha': None,
+            'Symbol': universo['Symbol'][repetidos],
+            'coluna': 'Symbol',
+            'valor': universo['Symbol'][repetidos],
+            'motivo': 'símbolo já listado em outra bolsa (linha descartada)',
+            'Exchange': universo['Exchange'][repetidos]
+        }))
+        universo = universo[~repetidos].reset_index(drop=True)
+    relatorios = [relatorio for relatorio in relatorios if len(relatorio)]
+    relatorio = (pd.concat(relatorios, ignore_index=True) if relatorios else
+                 pd.DataFrame(columns=['linha', 'Symbol', 'coluna', 'valor', 'motivo', 'Exchange']))
+    
+    contagem = universo['Exchange'].value_counts().to_dict()
+    print(f"🌎 Universo unificado: {len(universo)} ativos {contagem}, "
+          f"{int(repetidos.sum())} símbolos repetidos entre bolsas descartados")
+    return universo, relatorio
+
+def selecionar_top_n(scores, top_n):
+    """
+    Seleção parcial (argpartition) das top_n maiores pontuações de cada linha de `scores`
+    Empates pela menor posição, como no nlargest; posições com -inf nunca são retornadas
+    Retorna listas (posições, pontuações) por linha
+    """
+    scores = np.atleast_2d(scores)
+    n_linhas, n_colunas = scores.shape
+    top_n = min(top_n, n_colunas)
+    if top_n <= 0:
+        return [np.array([], dtype=np.int64)] * n_linhas, [np.array([])] * n_linhas
+    
+    # Valor de corte de cada linha (top_n-ésima maior pontuação)
+    corte = -np.partition(-scores, top_n - 1, axis=1)[:, top_n - 1]
+    maiores = scores > corte[:, None]
+    iguais = scores == corte[:, None]
+    faltam = top_n - maiores.sum(axis=1)
+    selecionados = maiores | iguais
+    
+    # Só linhas com empate no corte precisam descartar os iguais de maior posição
+    com_empate = np.flatnonzero(iguais.sum(axis=1) > faltam)
+    if len(com_empate):
+        excedentes = np.cumsum(iguais[com_empate], axis=1) > faltam[com_empate, None]
+        selecionados[com_empate] &= ~(iguais[com_empate] & excedentes)
+    
+    posicoes = np.nonzero(selecionados)[1].reshape(n_linhas, top_n)
+    valores = np.take_along_axis(scores, posicoes, axis=1)
+    ordem = np.argsort(-valores, axis=1, kind='stable')
+    posicoes = np.take_along_axis(posicoes, ordem, axis=1)
+    valores = np.take_along_axis(valores, ordem, axis=1)
+    
+    validos = valores > -np.inf
+    return ([p[v] for p, v in zip(posicoes, validos)],
+            [x[v] for x, v in zip(valores, validos)])
 
 def analisar_sentimento_texto(texto):
     """Análise simples de sentimento baseada em palavras-chave"""
@@ -84,17 +455,178 @@ def analisar_sentimento_texto(texto):
     else:
         return "neutro"
 
+class CacheLRU:
+    """Cache LRU em memória, seguro entre threads, com `validade` opcional (segundos)"""
+    def __init__(self, capacidade=1024, validade=None):
+        self.capacidade = capacidade
+        self.validade = validade
+        self.acertos = 0
+        self.falhas = 0
+        self._itens = OrderedDict()     # chave -> (valor, instante em que foi guardado)
+        self._trava = threading.Lock()
+    
+    def obter(self, chave, padrao=None):
+        with self._trava:
+            item = self._itens.get(chave)
+            if item is not None and self.validade is not None and time.monotonic() - item[1] > self.validade:
+                del self._itens[chave]
+                item = None
+            if item is None:
+                self.falhas += 1
+                return padrao
+            self.acertos += 1
+            self._itens.move_to_end(chave)
+            return item[0]
+    
+    def guardar(self, chave, valor):
+        with self._trava:
+            self._itens[chave] = (valor, time.monotonic())
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.capacidade:
+                self._itens.popitem(last=False)
+    
+    def limpar(self):
+        with self._trava:
+            self._itens.clear()
+    
+    def estatisticas(self):
+        """Acertos, falhas, taxa de acerto e itens guardados"""
+        with self._trava:
+            consultas = self.acertos + self.falhas
+            return {'acertos': self.acertos, 'falhas': self.falhas,
+                    'taxa_acerto': self.acertos / consultas if consultas else 0.0,
+                    'itens': len(self._itens)}
+    
+    def __len__(self):
+        return len(self._itens)
+
 # ============ CLASSES DO SISTEMA ============
 
 class Carteira:
     """Classe para a carteira de investimentos do cliente"""
     def __init__(self, tickers, quantidades):
-        self.tickers = tickers            # Ações da carteira
-        self.quantidades = quantidades    # Quantidade de ações na carteira
+        self.tickers = list(tickers)          # Ações da carteira
+        self.quantidades = list(quantidades)  # Quantidade de ações na carteira
+        self._posicoes = {}                   # Ticker -> posição na lista (primeira ocorrência)
+        # Compras e vendas ajustam o cache com o vetor de uma só ação; edições
+        # diretas em tickers/quantidades mudam a composição e o descartam
+        self._cache_vetor = None              # (chave do índice, índice, pesos por linha, soma, peso total)
+        self._composicao_cache = None         # Composição a que _posicoes e o cache correspondem
+        self._trava = threading.RLock()       # Webhooks leem e alteram a carteira em paralelo
+        self._sincronizar()
     
     def __str__(self):
         return f"Carteira com {len(self.tickers)} ativos"
     
+    def _composicao(self):
+        """Tickers e quantidades atuais, como tupla comparável"""
+        return tuple(self.tickers), tuple(self.quantidades)
+    
+    def _sincronizar(self):
+        """Refaz posições e descarta o cache se as listas mudaram fora de comprar/vender"""
+        composicao = self._composicao()
+        if composicao != self._composicao_cache:
+            self._posicoes = {}
+            for i, ticker in enumerate(self.tickers):
+                self._posicoes.setdefault(ticker, i)
+            self._cache_vetor = None
+            self._composicao_cache = composicao
+    
+    def vetor_ponderado(self, sistema):
+        """
+        Retorna (pesos por linha elegível, soma ponderada das features, peso
+        total) no índice `sistema`, remontando só se o índice ou a composição mudou
+        """
+        chave = sistema._chave_vetores()
+        with self._trava:
+            self._sincronizar()
+            cache = self._cache_vetor
+            if cache is None or any(a is not b for a, b in zip(cache[0], chave)):
+                linhas, pesos = sistema._linhas_carteira(self)
+                cache = (chave, sistema, dict(zip(linhas, pesos.tolist())),
+                         sistema._vetor_carteira(linhas, pesos), float(pesos.sum()))
+                self._cache_vetor = cache
+        return cache[2], cache[3], cache[4]
+    
+    def _ajustar_cache(self, ticker, delta):
+        """
+        Soma `delta` ações de `ticker` ao vetor em cache (O(features)); troca a
+        tupla inteira em vez de alterar no lugar, pois leitores podem estar com a anterior
+        """
+        if self._cache_vetor is not None:
+            chave, sistema, pesos_por_linha, soma, total = self._cache_vetor
+            linha = sistema.indice_simbolos.get(ticker)
+            if linha is not None and sistema.mascara_elegivel[linha]:
+                soma = soma + sistema._vetor_carteira([linha], np.array([delta], dtype=float))
+                pesos_por_linha = dict(pesos_por_linha)
+                peso = pesos_por_linha.get(linha, 0.0) + delta
+                if peso == 0:
+                    pesos_por_linha.pop(linha, None)
+                else:
+                    pesos_por_linha[linha] = peso
+                self._cache_vetor = (chave, sistema, pesos_por_linha, soma, total + delta)
+        self._composicao_cache = self._composicao()
+    
+    def adicionar_ticker(self, ticker, quantidade):
+        """Inclui um ticker novo na carteira (ou compra mais, se já existir)"""
+        with self._trava:
+            self._sincronizar()
+            if ticker in self._posicoes:
+                return self.comprar(ticker, quantidade)
+            self._posicoes[ticker] = len(self.tickers)
+            self.tickers.append(ticker)
+            self.quantidades.append(quantidade)
+            self._ajustar_cache(ticker, quantidade)
+        msg = f"✅ {ticker} adicionado à carteira ({quantidade} ações)"
+        print(msg)
+        return True, msg
+    
+    def comprar(self, ticker, quantidade):
+        """Aumenta a posição em `ticker` (inclui o ticker se for novo)"""
+        if quantidade <= 0:
+            erro_msg = f"❌ Quantidade inválida para compra: {quantidade}"
+            print(erro_msg)
+            return False, erro_msg
+        with self._trava:
+            self._sincronizar()
+            if ticker not in self._posicoes:
+                return self.adicionar_ticker(ticker, quantidade)
+            self.quantidades[self._posicoes[ticker]] += quantidade
+            self._ajustar_cache(ticker, quantidade)
+            posicao = self.quantidades[self._posicoes[ticker]]
+        msg = f"✅ Compra de {quantidade} {ticker} (posição: {posicao})"
+        print(msg)
+        return True, msg
+    
+    def vender(self, ticker, quantidade):
+        """Reduz a posição em `ticker`; zerada, a ação sai da carteira"""
+        with self._trava:
+            self._sincronizar()
+            posicao = self._posicoes.get(ticker)
+            if posicao is None or quantidade <= 0 or quantidade > self.quantidades[posicao]:
+                erro_msg = f"❌ Venda inválida: {quantidade} {ticker}"
+                print(erro_msg)
+                return False, erro_msg
+            
+            self.quantidades[posicao] -= quantidade
+            restante = self.quantidades[posicao]
+            if restante == 0:
+                del self.tickers[posicao]
+                del self.quantidades[posicao]
+                del self._posicoes[ticker]
+                self._posicoes = {t: (i if i < posicao else i - 1) for t, i in self._posicoes.items()}
+            self._ajustar_cache(ticker, -quantidade)
+            # Uma ocorrência repetida do mesmo ticker passa a valer
+            if restante == 0 and ticker in self.tickers:
+                self._posicoes[ticker] = self.tickers.index(ticker)
+                self._cache_vetor = None
+        if restante == 0:
+            msg = f"✅ Venda de {quantidade} {ticker} (posição encerrada)"
+        else:
+            msg = f"✅ Venda de {quantidade} {ticker} (posição: {restante})"
+        print(msg)
+        return True, msg
+    
     def mostrar_carteira(self):
         """Exibe os ativos da carteira e retorna como string"""
         buffer = "Ação - Quantidade:\n"
@@ -126,12 +658,416 @@ class Cliente:
         buffer += self.carteira.mostrar_carteira()
         return buffer
 
+class IndiceIVF:
+    """
+    Índice aproximado de vizinhos mais próximos (IVF): grupos por k-means esférico, e a
+    consulta só pontua as linhas dos `n_sondas` grupos de centroide mais próximo
+    """
+    def __init__(self, centroides, grupos, n_sondas=8):
+        self.centroides = centroides                      # Centroides unitários (k x d)
+        self.grupos = np.asarray(grupos, dtype=np.int32)  # Grupo de cada linha do índice
+        self.n_sondas = n_sondas
+        # Listas invertidas: linhas ordenadas por grupo e início de cada grupo
+        self.ordem = np.argsort(self.grupos, kind='stable').astype(np.int32)
+        self.inicios = np.searchsorted(self.grupos[self.ordem], np.arange(len(centroides) + 1))
+    
+    @classmethod
+    def construir(cls, sistema, n_grupos=None, n_sondas=8, n_iteracoes=10, semente=0,
+                  tamanho_bloco=64):
+        """Agrupa as linhas do índice do sistema por k-means esférico"""
+        n_linhas = len(sistema.simbolos)
+        if n_grupos is None:
+            n_grupos = int(np.sqrt(n_linhas))
+        n_grupos = max(1, min(n_grupos, n_linhas))
+        
+        rng = np.random.default_rng(semente)
+        todas = np.arange(n_linhas)
+        centroides = sistema._agregar_linhas(rng.choice(n_linhas, n_grupos, replace=False),
+                                             np.arange(n_grupos), n_grupos, normalizar=True)
+        
+        for _ in range(n_iteracoes):
+            # Atribuição: centroide de maior similaridade, em blocos de centroides
+            melhor = np.full(n_linhas, -np.inf)
+            grupos = np.zeros(n_linhas, dtype=np.int64)
+            for inicio in range(0, n_grupos, tamanho_bloco):
+                sims = sistema._pontuar_lote(centroides[inicio:inicio + tamanho_bloco])
+                bloco_melhor = sims.argmax(axis=1)
+                valores = sims[todas, bloco_melhor]
+                melhora = valores > melhor
+                melhor[melhora] = valores[melhora]
+                grupos[melhora] = inicio + bloco_melhor[melhora]
+            
+            # Atualização: soma dos vetores unitários de cada grupo, renormalizada
+            somas = sistema._agregar_linhas(todas, grupos, n_grupos, normalizar=True)
+            normas = np.linalg.norm(somas, axis=1)
+            vazios = normas == 0
+            if vazios.any():
+                # Grupos vazios recomeçam em linhas aleatórias
+                somas[vazios] = sistema._agregar_linhas(rng.choice(n_linhas, int(vazios.sum()), replace=False),
+                                                        np.arange(int(vazios.sum())), int(vazios.sum()),
+                                                        normalizar=True)
+                normas[vazios] = np.linalg.norm(somas[vazios], axis=1)
+            centroides = somas / np.where(normas == 0, 1.0, normas)[:, None]
+        
+        return cls(centroides, grupos, n_sondas)
+    
+    def candidatos(self, vetor_unitario, n_sondas=None):
+        """Linhas (em ordem crescente) dos grupos mais próximos do vetor"""
+        n_sondas = min(n_sondas or self.n_sondas, len(self.centroides))
+        sims = self.centroides @ vetor_unitario
+        sondados = np.argpartition(-sims, n_sondas - 1)[:n_sondas]
+        return np.sort(np.concatenate([self.ordem[self.inicios[g]:self.inicios[g + 1]]
+                                       for g in sondados]))
+    
+    def salvar(self, caminho):
+        """Persiste o índice em um arquivo .npz"""
+        np.savez(caminho, centroides=self.centroides, grupos=self.grupos,
+                 n_sondas=self.n_sondas)
+    
+    @classmethod
+    def carregar(cls, caminho):
+        """Carrega um índice salvo com `salvar`"""
+        with np.load(caminho) as dados:
+            return cls(dados['centroides'], dados['grupos'], int(dados['n_sondas']))
+
+class IndiceFiltros:
+    """
+    Índices de bits (np.packbits, um bit por linha) para filtrar o universo de ativos
+    Filtro: dict (E entre as condições) ou lista de dicts (OU entre eles)
+    """
+    # Faixas de capitalização de mercado em US$ (mínimo inclusivo, máximo exclusivo)
+    FAIXAS_CAPITALIZACAO = {
+        'nano': (0, 50e6),
+        'micro': (50e6, 300e6),
+        'small': (300e6, 2e9),
+        'mid': (2e9, 10e9),
+        'large': (10e9, 200e9),
+        'mega': (200e9, np.inf)
+    }
+    
+    def __init__(self, n_linhas, categoricas, numericas):
+        """
+        `categoricas`: {chave: (vocabulário, códigos)}; `numericas`:
+        {chave: valores brutos} (NaN = ausente, nunca passa no filtro)
+        """
+        self.n_linhas = n_linhas
+        
+        # Um conjunto de bits por valor de cada categórica, pré-calculado na carga
+        self.bits_categorias = {}
+        for chave, (vocabulario, codigos) in categoricas.items():
+            codigos = np.asarray(codigos)
+            posicoes = {str(valor): i for i, valor in enumerate(vocabulario)}
+            bits = np.packbits(codigos[None, :] == np.arange(len(vocabulario))[:, None], axis=1)
+            self.bits_categorias[chave] = (posicoes, bits)
+        
+        # Linhas ordenadas por coluna numérica: um intervalo marca só as suas linhas
+        self.ordenados = {}
+        for chave, valores in numericas.items():
+            valores = np.asarray(valores, dtype=float)
+            ordem = np.argsort(valores, kind='stable')   # NaN vai para o fim
+            self.ordenados[chave] = (ordem, valores[ordem], int((~np.isnan(valores)).sum()))
+        
+        self.bits_faixas = {}
+        if 'capitalizacao' in self.ordenados:
+            for nome, (minimo, maximo) in self.FAIXAS_CAPITALIZACAO.items():
+                self.bits_faixas[nome] = self._bits_intervalo('capitalizacao', minimo, maximo,
+                                                              maximo_inclusivo=False)
+    
+    def _bits_linhas(self, linhas):
+        """Conjunto de bits com as linhas informadas"""
+        mascara = np.zeros(self.n_linhas, dtype=bool)
+        mascara[linhas] = True
+        return np.packbits(mascara)
+    
+    def _bits_intervalo(self, chave, minimo, maximo, maximo_inclusivo=True):
+        """Linhas com valor em [minimo, maximo] (None = sem limite) pelo índice ordenado"""
+        ordem, valores_ordenados, n_validos = self.ordenados[chave]
+        validos = valores_ordenados[:n_validos]
+        inicio = 0 if minimo is None else np.searchsorted(validos, minimo, side='left')
+        fim = n_validos if maximo is None else np.searchsorted(
+            validos, maximo, side='right' if maximo_inclusivo else 'left')
+        return self._bits_linhas(ordem[inicio:max(inicio, fim)])
+    
+    def chaves(self):
+        return list(self.bits_categorias) + list(self.ordenados)
+    
+    def _condicao(self, chave, valor):
+        """Conjunto de bits de uma condição: valor ou lista (categóricas), (mínimo, máximo) ou faixas"""
+        if chave in self.bits_categorias:
+            posicoes, bits = self.bits_categorias[chave]
+            valores = [valor] if isinstance(valor, str) else list(valor)
+            resultado = np.zeros(bits.shape[1], dtype=np.uint8)
+            for v in valores:
+                if str(v) in posicoes:
+                    resultado |= bits[posicoes[str(v)]]
+            return resultado
+        
+        if chave in self.ordenados:
+            if chave == 'capitalizacao' and (isinstance(valor, str) or
+                                             all(isinstance(v, str) for v in valor)):
+                faixas = [valor] if isinstance(valor, str) else list(valor)
+                desconhecidas = [f for f in faixas if f not in self.bits_faixas]
+                if desconhecidas:
+                    raise ValueError(f"Faixa de capitalização inválida: {desconhecidas} "
+                                     f"(use {list(self.FAIXAS_CAPITALIZACAO)})")
+                resultado = np.zeros_like(self.bits_faixas[faixas[0]]) if faixas else \
+                    np.zeros((self.n_linhas + 7) // 8, dtype=np.uint8)
+                for faixa in faixas:
+                    resultado |= self.bits_faixas[faixa]
+                return resultado
+            if isinstance(valor, (int, float, np.number)):
+                return self._bits_intervalo(chave, valor, valor)     # Número único: igualdade
+            if not isinstance(valor, (list, tuple)) or len(valor) != 2:
+                raise ValueError(f"Filtro {chave} espera um número ou intervalo (mínimo, máximo): {valor!r}")
+            minimo, maximo = valor
+            return self._bits_intervalo(chave, minimo, maximo)
+        
+        raise ValueError(f"Filtro inválido: {chave} (use {self.chaves()})")
+    
+    def avaliar(self, filtros):
+        """Máscara booleana das linhas que atendem ao filtro (dict ou lista de dicts)"""
+        alternativas = [filtros] if isinstance(filtros, dict) else list(filtros)
+        resultado = np.zeros((self.n_linhas + 7) // 8, dtype=np.uint8)
+        for condicoes in alternativas:
+            bits = np.full_like(resultado, 0xFF)
+            for chave, valor in condicoes.items():
+                bits &= self._condicao(chave, valor)
+            resultado |= bits
+        return np.unpackbits(resultado, count=self.n_linhas).astype(bool)
+
+# Arrays compartilhados e layout das colunas, mapeados uma vez por processo do pool
+_arrays_fragmentos = {}
+_memorias_fragmentos = []
+
+def _anexar_fragmentos(especificacoes, layout):
+    """Inicializador dos processos do pool: mapeia a memória compartilhada sem copiar"""
+    for nome, (nome_memoria, forma, tipo) in especificacoes.items():
+        memoria = shared_memory.SharedMemory(name=nome_memoria)
+        _memorias_fragmentos.append(memoria)
+        _arrays_fragmentos[nome] = np.ndarray(forma, dtype=np.dtype(tipo), buffer=memoria.buf)
+    _arrays_fragmentos['layout'] = layout
+
+def _ranquear_fragmento(tarefa):
+    """
+    Pontua as linhas [inicio, fim) contra os vetores unitários (d x B) e
+    retorna, por vetor, (linhas globais, pontuações) do top_n do fragmento
+    """
+    inicio, fim, unitarios, indice_normas, excluidas, top_n = tarefa
+    offsets, tamanhos, offset_numericas, offset_embeddings = _arrays_fragmentos['layout']
+    codigos = _arrays_fragmentos['codigos'][inicio:fim]
+    
+    produto = np.zeros((fim - inicio, unitarios.shape[1]))
+    for j, (offset, tamanho) in enumerate(zip(offsets, tamanhos)):
+        produto += unitarios[offset:offset + tamanho][codigos[:, j]]
+    produto += _arrays_fragmentos['valores'][inicio:fim] @ unitarios[offset_numericas:offset_embeddings]
+    produto += _arrays_fragmentos['embeddings'][inicio:fim] @ unitarios[offset_embeddings:]
+    produto *= _arrays_fragmentos['inversos'][indice_normas, inicio:fim, None]
+    
+    produto[~_arrays_fragmentos['mascara'][inicio:fim]] = -np.inf
+    for b, linhas in enumerate(excluidas):
+        locais = linhas[(linhas >= inicio) & (linhas < fim)] - inicio
+        produto[locais, b] = -np.inf
+    
+    posicoes, valores = selecionar_top_n(produto.T, top_n)
+    return [(p + inicio, v) for p, v in zip(posicoes, valores)]
+
+class PoolFragmentos:
+    """
+    Pontuação em vários núcleos com o índice dividido em fragmentos de linhas
+    (arrays em memória compartilhada, mapeados pelos processos sem cópia)
+    """
+    def __init__(self, sistema, n_processos=None, n_fragmentos=None):
+        n_processos = n_processos or os.cpu_count() or 1
+        n_fragmentos = n_fragmentos or n_processos
+        n_linhas = len(sistema.simbolos)
+        
+        perfis = [None] + list(sistema.indices_perfil)
+        self.indices_normas = {perfil: i for i, perfil in enumerate(perfis)}
+        arrays = {
+            'codigos': np.asarray(sistema.codigos_categorias),
+            'valores': np.asarray(sistema.valores_normalizados),
+            'inversos': np.vstack([sistema.inverso_normas] +
+                                  [sistema.indices_perfil[perfil]['inverso_normas'] for perfil in perfis[1:]]),
+            'mascara': np.asarray(sistema.mascara_elegivel, dtype=bool),
+            'embeddings': (np.empty((n_linhas, 0), dtype=sistema.tipo_features) if sistema.embeddings is None
+                           else np.asarray(sistema.embeddings))
+        }
+        
+        # Os processos só mapeiam os blocos: a memória não cresce com o número de núcleos
+        self._memorias = []
+        especificacoes = {}
+        for nome, array in arrays.items():
+            memoria = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=memoria.buf)[...] = array
+            self._memorias.append(memoria)
+            especificacoes[nome] = (memoria.name, array.shape, array.dtype.str)
+        layout = ([int(o) for o in sistema.offsets_categorias], [len(c) for c in sistema.categorias],
+                  sistema.offsets_categorias_fim, sistema.offsets_numericas_fim)
+        
+        limites = np.linspace(0, n_linhas, n_fragmentos + 1).astype(int)
+        self.fragmentos = [(int(a), int(b)) for a, b in zip(limites[:-1], limites[1:]) if b > a]
+        self.n_processos = n_processos
+        self._uso = threading.Condition()   # Consultas em andamento; encerrar espera por elas
+        self._em_uso = 0
+        self._encerrado = False
+        self._pool = multiprocessing.get_context().Pool(
+            n_processos, initializer=_anexar_fragmentos, initargs=(especificacoes, layout))
+    
+    def ranquear(self, unitarios, perfil, excluidas, top_n):
+        """
+        `unitarios`: vetores unitários (d x B) com os pesos do perfil já
+        aplicados; `excluidas`: uma lista de linhas por vetor. Retorna, por
+        vetor, (linhas, pontuações) do top_n global.
+        """
+        excluidas = [np.asarray(linhas, dtype=np.int64) for linhas in excluidas]
+        tarefas = [(inicio, fim, unitarios, self.indices_normas[perfil], excluidas, top_n)
+                   for inicio, fim in self.fragmentos]
+        with self._uso:
+            if self._encerrado:
+                return None
+            self._em_uso += 1
+        try:
+            parciais = self._pool.map(_ranquear_fragmento, tarefas)
+        finally:
+            with self._uso:
+                self._em_uso -= 1
+                self._uso.notify_all()
+        
+        # Top_n de cada fragmento intercalado (heapq.merge), com o mesmo desempate por posição
+        resultados = []
+        for b in range(unitarios.shape[1]):
+            listas = [list(zip((-parcial[b][1]).tolist(), parcial[b][0].tolist())) for parcial in parciais]
+            melhores = list(itertools.islice(heapq.merge(*listas), top_n))
+            resultados.append((np.array([linha for _, linha in melhores], dtype=np.int64),
+                               np.array([-score for score, _ in melhores])))
+        return resultados
+    
+    def encerrar(self):
+        """Encerra os processos e libera a memória compartilhada (após as consultas em andamento)"""
+        with self._uso:
+            if self._encerrado:
+                return
+            self._encerrado = True
+            while self._em_uso:
+                self._uso.wait()
+        self._pool.terminate()
+        self._pool.join()
+        for memoria in self._memorias:
+            memoria.close()
+            memoria.unlink()
+        self._memorias = []
+
 class SistemaRecomendacao:
     """Sistema de recomendação baseado em similaridade"""
     
-    def __init__(self, dados_nasdaq):
+    # 'esparso': matriz one-hot (CSR) pré-normalizada; 'codigos': só os códigos
+    # inteiros das categorias, com o produto escalar vindo dos pesos da carteira
+    MODOS_PONTUACAO = ('esparso', 'codigos')
+    ESTRATEGIAS = ('exata', 'ann', 'vizinhos')
+    
+    # Acima desta fração do universo em candidatos, a poda não compensa; abaixo
+    # deste número de ativos, a varredura completa já é mais rápida que a poda
+    # (medido: empate até ~14 mil ativos, ~25% mais rápida com NASDAQ+NYSE+AMEX,
+    # ~21 mil; só com o screener da NASDAQ, ~7 mil, a poda fica desligada)
+    FRACAO_MAXIMA_PODA = 0.5
+    MINIMO_LINHAS_PODA = 15000
+    
+    # Reordenação por diversidade (MMR), opcional: peso da relevância por perfil
+    # do cliente (perfil sem entrada ou 1.0 = só relevância, o padrão), ex.
+    # {'conservador': 0.5}, e quantos candidatos entram na reordenação
+    LAMBDA_MMR_POR_PERFIL = {}
+    CANDIDATOS_MMR = 200
+    
+    # Consultas "parecidas com" memorizadas por índice
+    CAPACIDADE_CACHE_SIMILARES = 1024
+    
+    # Pesos das features por perfil do cliente (colunas ausentes = 1.0). Cada
+    # perfil com pesos próprios ganha na carga seu índice pré-ponderado e
+    # pré-normalizado; perfis sem entrada usam o índice base.
+    PESOS_POR_PERFIL = {
+        'conservador': {'MC': 2.0, 'Sector': 1.5, 'PC': 0.5},
+        'moderado': {},
+        'arrojado': {'PC': 2.0, 'MC': 0.5}
+    }
+    
+    # Mapeamento flexível de colunas
+    MAPEAMENTO_COLUNAS = {
+        'Last Sale': 'LS', 
+        'Net Change': 'NC', 
+        '% Change': 'PC', 
+        'Market Cap': 'MC', 
+        'IPO Year': 'IPOY'
+    }
+    
+    # Colunas que mudam ao longo do pregão (as categóricas ficam fixas)
+    COLUNAS_PRECO = ['LS', 'NC', 'PC', 'MC', 'Volume']
+    
+    # Colunas só usadas em filtros (não entram nas features)
+    COLUNAS_FILTRO = ['IPOY', 'Volume']
+    # Preenchidas com 0 no pré-processamento, onde 0 quer dizer "sem dado": nos
+    # filtros viram NaN e não passam em nenhum intervalo (como o ano de IPO 0)
+    COLUNAS_ZERO_AUSENTE = ['LS', 'MC']
+    
+    # Chaves aceitas em `filtros` -> coluna dos dados
+    CHAVES_FILTRO = {
+        'setor': 'Sector',
+        'pais': 'Country',
+        'industria': 'Industry',
+        'preco': 'LS',
+        'capitalizacao': 'MC',
+        'ano_ipo': 'IPOY',
+        'volume': 'Volume'
+    }
+    
+    # Tipos dos dados processados no modo compacto (features, normas e matrizes
+    # de pontuação em float32; consultas, valores brutos e filtros em float64)
+    TIPOS_COMPACTOS = {
+        'Country': 'category',
+        'Sector': 'category',
+        'Industry': 'category',
+        'LS': np.float32,
+        'PC': np.float32,
+        'MC': np.float32,
+        'Volume': np.uint32
+    }
+    # Diferença máxima das pontuações (cosseno) entre o modo compacto e o normal
+    TOLERANCIA_COMPACTO = 1e-5
+    
+    # Arrays centrais do índice gravados no snapshot (um .npy cada)
+    ARRAYS_SNAPSHOT = ['simbolos', 'codigos_categorias', 'valores_normalizados',
+                       'valores_brutos', 'atributos_filtro', 'normas', 'mascara_elegivel']
+    FORMATO_SNAPSHOT = 2
+    FORMATO_CACHE_DADOS = 2
+    
+    def __init__(self, dados_nasdaq, modo='esparso', compacto=False, dados_processados=None):
+        if modo not in self.MODOS_PONTUACAO:
+            raise ValueError(f"Modo de pontuação inválido: {modo} (use {self.MODOS_PONTUACAO})")
+        self.modo = modo
+        self.compacto = compacto
+        self.embeddings = None
+        self.indice_ann = None
+        self.vizinhos_linhas = None
+        self.vizinhos_scores = None
+        self.pool_fragmentos = None
+        self.geracao = 0                  # Conta alterações no lugar (preços, embeddings, ANN, vizinhos)
         self.dados_nasdaq = dados_nasdaq
-        self._preprocessar_dados()
+        if dados_processados is None:
+            self._preprocessar_dados()
+        else:
+            # Já pré-processados (cache em disco): usados diretamente, sem cópia
+            self.dados_processados = dados_processados
+        self._construir_indice()
+        if compacto:
+            # Depois do índice: valores brutos e filtros saem dos dados em precisão total
+            self._compactar_dados(self.dados_processados)
+    
+    @classmethod
+    def preprocessar(cls, dados_nasdaq):
+        """Só o pré-processamento, sem construir o índice (retorna os dados processados)"""
+        sistema = cls.__new__(cls)
+        sistema.dados_nasdaq = dados_nasdaq
+        sistema._preprocessar_dados()
+        return sistema.dados_processados
     
     def _preprocessar_dados(self):
         """Pré-processa os dados da NASDAQ de forma flexível"""
@@ -140,23 +1076,7 @@ class SistemaRecomendacao:
         # Criar uma cópia para não modificar o original
         self.dados_processados = self.dados_nasdaq.copy()
         
-        # Mapeamento flexível de colunas
-        mapeamento_colunas = {
-            'Last Sale': 'LS', 
-            'Net Change': 'NC', 
-            '% Change': 'PC', 
-            'Market Cap': 'MC', 
-            'IPO Year': 'IPOY'
-        }
-        
-        # Renomear apenas as colunas que existem
-        colunas_para_renomear = {}
-        for old_name, new_name in mapeamento_colunas.items():
-            if old_name in self.dados_processados.columns:
-                colunas_para_renomear[old_name] = new_name
-        
-        if colunas_para_renomear:
-            self.dados_processados.rename(columns=colunas_para_renomear, inplace=True)
+        self._renomear_colunas(self.dados_processados)
         
         # Colunas para preencher valores nulos
         colunas_para_preencher = ['Industry', 'Sector', 'Country', 'PC', 'MC']
@@ -171,20 +1091,53 @@ class SistemaRecomendacao:
         if 'IPOY' in self.dados_processados.columns:
             self.dados_processados['IPOY'] = self.dados_processados['IPOY'].fillna(0)
         
-        # Converter formatos de forma segura
-        if 'LS' in self.dados_processados.columns:
-            self.dados_processados['LS'] = self.dados_processados['LS'].astype(str).str.replace('$', '', regex=False)
-            self.dados_processados['LS'] = pd.to_numeric(self.dados_processados['LS'], errors='coerce').fillna(0)
-        
-        if 'PC' in self.dados_processados.columns:
-            self.dados_processados['PC'] = self.dados_processados['PC'].astype(str).str.replace('%', '', regex=False)
-            self.dados_processados['PC'] = pd.to_numeric(self.dados_processados['PC'], errors='coerce').fillna(0)
+        self._converter_formatos(self.dados_processados)
         
         print(f"✅ Dados pré-processados: {len(self.dados_processados)} ativos")
         print(f"📋 Colunas disponíveis: {list(self.dados_processados.columns)}")
     
-    def _criar_features(self, df):
-        """Cria features para o algoritmo de recomendação de forma flexível"""
+    def _renomear_colunas(self, df):
+        """Renomeia (no próprio DataFrame) apenas as colunas do mapeamento que existem"""
+        colunas_para_renomear = {}
+        for old_name, new_name in self.MAPEAMENTO_COLUNAS.items():
+            if old_name in df.columns:
+                colunas_para_renomear[old_name] = new_name
+        
+        if colunas_para_renomear:
+            df.rename(columns=colunas_para_renomear, inplace=True)
+    
+    def _converter_formatos(self, df, preencher=True):
+        """Converte (no próprio DataFrame) '$' de LS e '%' de PC para número de forma segura (já numéricas passam direto)"""
+        for col in ['LS', 'PC']:
+            if col in df.columns:
+                df[col] = converter_numerico(df[col])
+                if preencher:
+                    df[col] = df[col].fillna(0)
+    
+    def _compactar_dados(self, df):
+        """Converte (no próprio DataFrame, que é retornado) as colunas de TIPOS_COMPACTOS para os tipos enxutos"""
+        for col, tipo in self.TIPOS_COMPACTOS.items():
+            if col not in df.columns:
+                continue
+            if tipo == 'category':
+                df[col] = df[col].astype('category')
+            elif np.issubdtype(tipo, np.integer):
+                limite = np.iinfo(tipo).max
+                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).clip(0, limite).astype(tipo)
+            else:
+                df[col] = pd.to_numeric(df[col], errors='coerce').astype(tipo)
+        return df
+    
+    @property
+    def tipo_features(self):
+        """Tipo de ponto flutuante das features, normas e matrizes de pontuação"""
+        return np.float32 if self.compacto else np.float64
+    
+    def _criar_features(self, df, mascara=None):
+        """
+        Cria features para o algoritmo de recomendação de forma flexível
+        Retorna (símbolos, colunas categóricas, categorias, códigos, colunas numéricas, valores normalizados) ou None
+        """
         # Colunas categóricas possíveis
         possiveis_cat_cols = ['Country', 'Sector', 'Industry']
         cat_cols = [col for col in possiveis_cat_cols if col in df.columns]
@@ -195,122 +1148,1515 @@ class SistemaRecomendacao:
         
         if not cat_cols and not num_cols:
             print("⚠️ Nenhuma coluna disponível para criar features")
-            return pd.DataFrame()
+            return None
         
         # Garantir que temos a coluna Symbol
         if 'Symbol' not in df.columns:
             print("❌ Coluna 'Symbol' não encontrada")
-            return pd.DataFrame()
+            return None
+        
+        # Códigos das categorias (ordem de aparição, como no One-Hot)
+        categorias = []
+        codigos = np.empty((len(df), len(cat_cols)), dtype=np.int32)
+        for j, col in enumerate(cat_cols):
+            codigos[:, j], valores_unicos = pd.factorize(df[col], use_na_sentinel=False)
+            categorias.append(np.asarray(valores_unicos, dtype=object))
+        
+        # int16 basta para vocabulários de até 32767 valores por coluna
+        if all(len(c) <= np.iinfo(np.int16).max for c in categorias):
+            codigos = codigos.astype(np.int16)
+        
+        # Normalizar colunas numéricas (mínimo e máximo só das linhas de `mascara`)
+        valores = np.empty((len(df), len(num_cols)), dtype=self.tipo_features)
+        for j, num_col in enumerate(num_cols):
+            valores[:, j] = min_max_scaler(df[num_col].values, mascara)
+        
+        return (df['Symbol'].to_numpy(dtype=object), cat_cols, categorias, codigos,
+                num_cols, valores)
+    
+    def _montar_matriz_esparsa(self):
+        """
+        Monta a matriz One-Hot + numéricas em CSR a partir dos códigos (os
+        embeddings colaborativos, densos, ficam fora e entram em _pontuar)
+        """
+        n_linhas = len(self.simbolos)
+        n_cat = len(self.colunas_categoricas)
+        n_num = len(self.colunas_numericas)
+        valores_por_linha = n_cat + n_num
+        
+        colunas_csr = np.empty((n_linhas, valores_por_linha), dtype=np.int32)
+        dados_csr = np.empty((n_linhas, valores_por_linha), dtype=self.tipo_features)
+        colunas_csr[:, :n_cat] = self.offsets_categorias + self.codigos_categorias
+        dados_csr[:, :n_cat] = self.pesos_categorias
+        colunas_csr[:, n_cat:n_cat + n_num] = self.offsets_categorias_fim + np.arange(n_num)
+        dados_csr[:, n_cat:n_cat + n_num] = self.valores_normalizados
+        
+        return MatrizEsparsaCSR(dados_csr.ravel(), colunas_csr.ravel(),
+                                np.arange(n_linhas + 1) * valores_por_linha,
+                                self.offsets_numericas_fim, self.tipo_features)
+    
+    def _construir_indice(self):
+        """Constrói o índice de features uma única vez por carga do screener"""
+        print("🧮 Construindo índice de recomendação...")
         
-        # One-Hot Encoding manual para categóricas
-        if cat_cols:
-            df_encoded = one_hot_encoding(df[['Symbol'] + cat_cols + num_cols], cat_cols)
+        # Máscara de elegibilidade: performance positiva, se houver PC (a normalização
+        # numérica usa só os elegíveis, como o filtro antigo aplicado antes das features)
+        if 'PC' in self.dados_processados.columns:
+            self.mascara_elegivel = (self.dados_processados['PC'] > 0).to_numpy()
         else:
-            df_encoded = df[['Symbol'] + num_cols].copy()
+            self.mascara_elegivel = np.ones(len(self.dados_processados), dtype=bool)
+        
+        self.matriz_normalizada = None
+        features = self._criar_features(self.dados_processados, self.mascara_elegivel)
+        
+        if features is None:
+            self.simbolos = np.array([], dtype=object)
+            self.indice_simbolos = {}
+            self.codigos_categorias = None
+            self.colunas_categoricas = []
+            self.colunas_numericas = []
+            self.colunas_features = []
+            self.normas = np.array([])
+            self.indices_perfil = {}
+            self.perfil_indice = None
+            self.indice_filtros = None
+            self.cache_similares = CacheLRU(self.CAPACIDADE_CACHE_SIMILARES)
+            print("⚠️ Índice de recomendação vazio")
+            return
+        
+        (self.simbolos, self.colunas_categoricas, self.categorias,
+         self.codigos_categorias, self.colunas_numericas, self.valores_normalizados) = features
+        self.valores_brutos = self.dados_processados[self.colunas_numericas].to_numpy(dtype=float)
+        
+        # Atributos só de filtro; ano de IPO 0 (preenchido) conta como ausente
+        self.colunas_filtro = [col for col in self.COLUNAS_FILTRO if col in self.dados_processados.columns]
+        self.atributos_filtro = np.column_stack(
+            [pd.to_numeric(self.dados_processados[col], errors='coerce').to_numpy(dtype=float)
+             for col in self.colunas_filtro]) if self.colunas_filtro else np.empty((len(self.simbolos), 0))
+        if 'IPOY' in self.colunas_filtro:
+            ipo = self.atributos_filtro[:, self.colunas_filtro.index('IPOY')]
+            ipo[ipo == 0] = np.nan
+        self._finalizar_indice()
+        
+        print(f"✅ Índice construído ({self.modo}): {len(self.simbolos)} ativos x "
+              f"{len(self.colunas_features)} features "
+              f"({int(self.mascara_elegivel.sum())} elegíveis)")
+    
+    def _finalizar_indice(self, normas=None):
+        """
+        Monta as estruturas derivadas dos arrays centrais do índice (códigos,
+        valores numéricos, símbolos): layout das colunas, normas, matriz
+        esparsa e mapa símbolo -> linha
+        """
+        # Layout das colunas: One-Hot de cada categórica, depois as numéricas
+        tamanhos = np.array([len(c) for c in self.categorias], dtype=np.int64)
+        self.offsets_categorias = np.cumsum(tamanhos) - tamanhos
+        self.offsets_categorias_fim = int(tamanhos.sum())
+        self.colunas_features = [f"{col}_{valor}"
+                                 for col, cats in zip(self.colunas_categoricas, self.categorias)
+                                 for valor in cats]
+        self.colunas_features += [f"{col}_normalized" for col in self.colunas_numericas]
+        self.offsets_numericas_fim = len(self.colunas_features)
+        if self.embeddings is not None:
+            self.colunas_features += [f"CF_{i}" for i in range(self.embeddings.shape[1])]
+        
+        # Índice base: todas as features com peso 1
+        self.pesos_categorias = np.ones(len(self.colunas_categoricas))
+        self.pesos_numericos = np.ones(len(self.colunas_numericas))
+        self.perfil_indice = None
+        self._atualizar_normas(normas)
+        
+        # Índice invertido: para cada categórica, linhas ordenadas por código
+        # e início da lista de cada código
+        self.invertido_ordem = []
+        self.invertido_inicios = []
+        for j, cats in enumerate(self.categorias):
+            codigos = np.asarray(self.codigos_categorias[:, j])
+            ordem = np.argsort(codigos, kind='stable').astype(np.int32)
+            self.invertido_ordem.append(ordem)
+            self.invertido_inicios.append(np.searchsorted(codigos[ordem], np.arange(len(cats) + 1)))
+        
+        self._construir_indice_filtros()
+        self.cache_similares = CacheLRU(self.CAPACIDADE_CACHE_SIMILARES)
+        
+        # Mapa símbolo -> linha (mantém a primeira ocorrência)
+        self.indice_simbolos = {}
+        for linha, simbolo in enumerate(self.simbolos.tolist()):
+            self.indice_simbolos.setdefault(simbolo, linha)
+    
+    def _construir_indice_filtros(self):
+        """(Re)constrói os índices de bits dos filtros a partir dos arrays do índice"""
+        categoricas, numericas = {}, {}
+        for chave, col in self.CHAVES_FILTRO.items():
+            if col in self.colunas_categoricas:
+                j = self.colunas_categoricas.index(col)
+                categoricas[chave] = (self.categorias[j], self.codigos_categorias[:, j])
+            elif col in self.colunas_numericas:
+                valores = np.asarray(self.valores_brutos[:, self.colunas_numericas.index(col)], dtype=float)
+                if col in self.COLUNAS_ZERO_AUSENTE:
+                    valores = np.where(valores == 0, np.nan, valores)
+                numericas[chave] = valores
+            elif col in self.colunas_filtro:
+                numericas[chave] = self.atributos_filtro[:, self.colunas_filtro.index(col)]
+        self.indice_filtros = IndiceFiltros(len(self.simbolos), categoricas, numericas)
+    
+    def _agregar_linhas(self, linhas, grupos, n_grupos, pesos=None, normalizar=False):
+        """
+        Soma (ponderada) das features das linhas em cada grupo, montada direto
+        dos códigos: retorna n_grupos x n_features. Com `normalizar`, cada
+        linha entra dividida pela sua norma.
+        """
+        linhas = np.asarray(linhas, dtype=np.int64)
+        pesos = np.ones(len(linhas)) if pesos is None else np.asarray(pesos, dtype=float)
+        if normalizar:
+            pesos = pesos * self.inverso_normas[linhas]
+        
+        resultado = np.zeros((n_grupos, len(self.colunas_features)))
+        for j, offset in enumerate(self.offsets_categorias):
+            tamanho = len(self.categorias[j])
+            chaves = np.asarray(grupos) * tamanho + self.codigos_categorias[linhas, j]
+            resultado[:, offset:offset + tamanho] = np.bincount(
+                chaves, weights=pesos * self.pesos_categorias[j],
+                minlength=n_grupos * tamanho).reshape(n_grupos, tamanho)
+        for j in range(len(self.colunas_numericas)):
+            resultado[:, self.offsets_categorias_fim + j] = np.bincount(
+                grupos, weights=self.valores_normalizados[linhas, j] * pesos, minlength=n_grupos)
+        if self.embeddings is not None:
+            np.add.at(resultado[:, self.offsets_numericas_fim:], np.asarray(grupos, dtype=np.int64),
+                      self.embeddings[linhas] * pesos[:, None])
+        return resultado
+    
+    def _calcular_normas(self, valores_normalizados, incluir_embeddings=True):
+        """
+        Normas das linhas: cada categórica contribui com o quadrado do seu peso
+        (1 no índice base), mais as numéricas e os embeddings colaborativos
+        """
+        normas_quadrado = np.full(len(valores_normalizados), float(np.sum(self.pesos_categorias ** 2)))
+        for j in range(valores_normalizados.shape[1]):
+            normas_quadrado += np.asarray(valores_normalizados[:, j], dtype=float) ** 2
+        if incluir_embeddings and self.embeddings is not None:
+            normas_quadrado += np.sum(self.embeddings ** 2, axis=1)
+        return np.sqrt(normas_quadrado)
+    
+    def _atualizar_normas(self, normas=None):
+        """Recalcula (ou adota) as normas das linhas e, no modo 'esparso', a matriz pré-normalizada"""
+        if normas is None:
+            normas = self._calcular_normas(self.valores_normalizados)
+        normas = np.asarray(normas, dtype=self.tipo_features)
+        
+        # Inverso das normas (linhas de norma zero continuam zeradas)
+        inverso_normas = 1.0 / np.where(normas == 0, 1.0, normas)
+        
+        if self.modo == 'esparso':
+            # Linhas pré-normalizadas
+            self.matriz_normalizada = self._montar_matriz_esparsa().escalar_linhas(inverso_normas)
+        self.normas, self.inverso_normas = normas, inverso_normas
+        self._construir_indices_perfil()
+    
+    def _construir_indices_perfil(self):
+        """
+        Pré-calcula, para cada perfil de PESOS_POR_PERFIL com algum peso
+        diferente de 1, as features numéricas já ponderadas, as normas e (no
+        modo 'esparso') a matriz pré-normalizada no espaço ponderado
+        """
+        self.indices_perfil = {}
+        for perfil, pesos in self.PESOS_POR_PERFIL.items():
+            pesos_categorias = np.array([pesos.get(col, 1.0) for col in self.colunas_categoricas], dtype=float)
+            pesos_numericos = np.array([pesos.get(col, 1.0) for col in self.colunas_numericas], dtype=float)
+            if np.all(pesos_categorias == 1) and np.all(pesos_numericos == 1):
+                continue
+            
+            visao = copy.copy(self)
+            visao.pesos_categorias = pesos_categorias
+            visao.pesos_numericos = pesos_numericos
+            visao.valores_normalizados = (np.asarray(self.valores_normalizados, dtype=float)
+                                          * pesos_numericos).astype(self.tipo_features)
+            normas = visao._calcular_normas(visao.valores_normalizados).astype(self.tipo_features)
+            arrays = {
+                'pesos_categorias': pesos_categorias,
+                'pesos_numericos': pesos_numericos,
+                'valores_normalizados': visao.valores_normalizados,
+                'normas': normas,
+                'inverso_normas': 1.0 / np.where(normas == 0, 1.0, normas),
+                'matriz_normalizada': None
+            }
+            if self.modo == 'esparso':
+                arrays['matriz_normalizada'] = visao._montar_matriz_esparsa().escalar_linhas(arrays['inverso_normas'])
+            self.indices_perfil[perfil] = arrays
+    
+    def _visao_perfil(self, perfil):
+        """
+        O próprio índice, ou uma cópia rasa com as features, normas e matriz
+        do perfil (o resto, como máscaras, índices aproximados e filtros, é
+        compartilhado com o índice base)
+        """
+        arrays = self.indices_perfil.get(perfil)
+        if arrays is None:
+            return self
+        visao = copy.copy(self)
+        visao.__dict__.update(arrays)
+        visao.indices_perfil = {}
+        visao.perfil_indice = perfil
+        return visao
+    
+    @staticmethod
+    def _bytes_estrutura(objeto):
+        """Bytes dos arrays NumPy (e matrizes CSR) dentro de dicts, listas, tuplas e índices auxiliares"""
+        if objeto is None:
+            return 0
+        if isinstance(objeto, (np.ndarray, MatrizEsparsaCSR)):
+            return int(objeto.nbytes)
+        if isinstance(objeto, dict):
+            return sum(SistemaRecomendacao._bytes_estrutura(valor) for valor in objeto.values())
+        if isinstance(objeto, (list, tuple)):
+            return sum(SistemaRecomendacao._bytes_estrutura(valor) for valor in objeto)
+        if isinstance(objeto, (IndiceFiltros, IndiceIVF)):
+            return SistemaRecomendacao._bytes_estrutura(vars(objeto))
+        return 0
+    
+    def relatorio_memoria(self):
+        """
+        Memória ocupada pelos dados processados e por cada estrutura do índice
+        Retorna (buffer, {componente: bytes}); arrays mapeados de um snapshot contam pelo tamanho mapeado
+        """
+        if self.codigos_categorias is None:
+            msg = "⚠️ Índice de recomendação vazio, sem memória a relatar"
+            print(msg)
+            return msg + "\n", {'total': 0}
+        
+        componentes = {
+            'dados_processados': (0 if self.dados_processados is None
+                                  else int(self.dados_processados.memory_usage(deep=True).sum())),
+            'codigos_categorias': self._bytes_estrutura(self.codigos_categorias),
+            'valores_normalizados': self._bytes_estrutura(self.valores_normalizados),
+            'valores_brutos': self._bytes_estrutura(self.valores_brutos),
+            'atributos_filtro': self._bytes_estrutura(self.atributos_filtro),
+            'normas': self._bytes_estrutura([self.normas, self.inverso_normas]),
+            'matriz_normalizada': self._bytes_estrutura(self.matriz_normalizada),
+            'embeddings': self._bytes_estrutura(self.embeddings),
+            'indices_perfil': self._bytes_estrutura(self.indices_perfil),
+            'indice_invertido': self._bytes_estrutura([self.invertido_ordem, self.invertido_inicios]),
+            'indice_filtros': self._bytes_estrutura(self.indice_filtros),
+            'indice_ann': self._bytes_estrutura(self.indice_ann),
+            'vizinhos': self._bytes_estrutura([self.vizinhos_linhas, self.vizinhos_scores])
+        }
+        total = sum(componentes.values())
+        
+        buffer = (f"\n📦 MEMÓRIA DO ÍNDICE ({self.modo}{', compacto' if self.compacto else ''}, "
+                  f"{len(self.simbolos)} ativos)\n" + "=" * 50 + "\n")
+        for nome, tamanho in componentes.items():
+            if tamanho:
+                buffer += f"  {nome:<22} {tamanho / 2**20:>9.2f} MB\n"
+        buffer += f"  {'total':<22} {total / 2**20:>9.2f} MB\n"
+        print(buffer.strip())
+        componentes['total'] = total
+        return buffer, componentes
+    
+    def atualizar_precos(self, df_delta):
+        """
+        Atualiza só as colunas de preço (COLUNAS_PRECO) dos símbolos de `df_delta`, sem reconstruir o índice
+        (categóricas e índice aproximado são mantidos)
+        """
+        if self.codigos_categorias is None or 'Symbol' not in df_delta.columns:
+            erro_msg = "❌ Atualização de preços indisponível (índice vazio ou sem coluna Symbol)"
+            print(erro_msg)
+            return False, erro_msg
+        
+        delta = df_delta.copy()
+        self._renomear_colunas(delta)
+        self._converter_formatos(delta, preencher=False)
+        colunas_existentes = (self.colunas_numericas + self.colunas_filtro if self.dados_processados is None
+                              else self.dados_processados.columns)
+        colunas = [col for col in self.COLUNAS_PRECO
+                   if col in delta.columns and col in colunas_existentes]
+        
+        linhas = delta['Symbol'].map(self.indice_simbolos)
+        conhecidos = linhas.notna().to_numpy()
+        linhas = linhas[conhecidos].to_numpy(dtype=np.int64)
+        delta = delta[conhecidos]
+        
+        if len(linhas) == 0 or not colunas:
+            msg = "⚠️ Nenhum símbolo conhecido ou coluna de preço para atualizar"
+            print(msg)
+            return False, msg
+        
+        # Atualizar valores brutos (e os dados processados, se carregados)
+        valores_brutos = np.array(self.valores_brutos, dtype=float)
+        atributos_filtro = np.array(self.atributos_filtro, dtype=float)
+        for col in colunas:
+            valores = pd.to_numeric(delta[col], errors='coerce').to_numpy(dtype=float)
+            # Célula vazia ou inválida no delta mantém o valor atual
+            presentes = ~np.isnan(valores)
+            linhas_col, valores = linhas[presentes], valores[presentes]
+            if self.dados_processados is not None:
+                # No modo compacto, gravar já no tipo enxuto da coluna (o pandas recusa float64 em float32)
+                novos = self._compactar_dados(pd.DataFrame({col: valores}))[col] if self.compacto else valores
+                # Coluna nova em vez de escrita no lugar: a do cache pode estar mapeada só para leitura
+                coluna = self.dados_processados[col].to_numpy(copy=True)
+                coluna[linhas_col] = np.asarray(novos)
+                self.dados_processados[col] = coluna
+            if col in self.colunas_numericas:
+                valores_brutos[linhas_col, self.colunas_numericas.index(col)] = valores
+            if col in self.colunas_filtro:
+                atributos_filtro[linhas_col, self.colunas_filtro.index(col)] = valores
+        
+        # Nova máscara e features numéricas afetadas (todas, se a máscara PC > 0 mudar)
+        mascara = self.mascara_elegivel
+        if 'PC' in colunas and 'PC' in self.colunas_numericas:
+            mascara = valores_brutos[:, self.colunas_numericas.index('PC')] > 0
+        afetadas = [col for col in self.colunas_numericas
+                    if col in colunas or not np.array_equal(mascara, self.mascara_elegivel)]
+        
+        valores_normalizados = np.array(self.valores_normalizados)
+        for col in afetadas:
+            j = self.colunas_numericas.index(col)
+            valores_normalizados[:, j] = min_max_scaler(valores_brutos[:, j], mascara)
+        
+        self.valores_brutos = valores_brutos
+        self.atributos_filtro = atributos_filtro
+        self.valores_normalizados = valores_normalizados
+        self._atualizar_normas()
+        self._construir_indice_filtros()
+        self.mascara_elegivel = mascara
+        # Cache novo (não limpar: uma cópia de outra versão pode compartilhar o antigo)
+        self.cache_similares = CacheLRU(self.CAPACIDADE_CACHE_SIMILARES)
+        self._reconstruir_pool_fragmentos()
+        self.geracao += 1
+        
+        msg = (f"✅ Preços atualizados: {len(linhas)} ativos, colunas {colunas}, "
+               f"features reescaladas {afetadas} ({int(mascara.sum())} elegíveis)")
+        print(msg)
+        return True, msg
+    
+    def salvar_snapshot(self, diretorio, caminho_csv):
+        """
+        Salva o índice construído em disco (um .npy por array em `diretorio/v<formato>-<hash do CSV>`)
+        para carga instantânea
+        """
+        if self.codigos_categorias is None:
+            erro_msg = "❌ Índice vazio, snapshot não salvo"
+            print(erro_msg)
+            return False, erro_msg
+        
+        hash_csv = hash_screeners(caminho_csv, diretorio)
+        destino = os.path.join(diretorio, f"v{self.FORMATO_SNAPSHOT}-{hash_csv[:16]}")
+        if os.path.exists(os.path.join(destino, 'manifest.json')):
+            msg = f"✅ Snapshot já existente em {destino}"
+            print(msg)
+            return True, msg
         
-        # Normalizar colunas numéricas
-        for num_col in num_cols:
-            if num_col in df_encoded.columns:
-                new_col_name = f"{num_col}_normalized"
-                df_encoded[new_col_name] = min_max_scaler(df_encoded[num_col].values)
-                df_encoded = df_encoded.drop(num_col, axis=1)
+        os.makedirs(diretorio, exist_ok=True)
+        # Escrito em um diretório temporário e renomeado no final: nunca se lê um snapshot pela metade
+        temporario = tempfile.mkdtemp(prefix='.tmp-', dir=diretorio)
+        try:
+            valores32 = np.asarray(self.valores_normalizados, dtype=np.float32)
+            arrays = {
+                'simbolos': np.asarray(self.simbolos, dtype=str),
+                'codigos_categorias': np.asarray(self.codigos_categorias),
+                'valores_normalizados': valores32,
+                'valores_brutos': np.asarray(self.valores_brutos, dtype=float),
+                'atributos_filtro': np.asarray(self.atributos_filtro, dtype=float),
+                # Normas coerentes com as features em float32
+                'normas': self._calcular_normas(valores32, incluir_embeddings=False),
+                'mascara_elegivel': np.asarray(self.mascara_elegivel, dtype=bool),
+            }
+            for nome in self.ARRAYS_SNAPSHOT:
+                np.save(os.path.join(temporario, f"{nome}.npy"), arrays[nome])
+            
+            manifest = {
+                'formato': self.FORMATO_SNAPSHOT,
+                'hash_csv': hash_csv,
+                'n_linhas': len(self.simbolos),
+                'colunas_categoricas': self.colunas_categoricas,
+                'categorias': [[str(valor) for valor in cats] for cats in self.categorias],
+                'colunas_numericas': self.colunas_numericas,
+                'colunas_filtro': self.colunas_filtro,
+                'criado_em': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            }
+            with open(os.path.join(temporario, 'manifest.json'), 'w', encoding='utf-8') as arquivo:
+                json.dump(manifest, arquivo, ensure_ascii=False)
+            
+            os.rename(temporario, destino)
+        except OSError as e:
+            shutil.rmtree(temporario, ignore_errors=True)
+            if os.path.exists(os.path.join(destino, 'manifest.json')):
+                # Outro processo salvou o mesmo snapshot primeiro
+                return True, f"✅ Snapshot já existente em {destino}"
+            erro_msg = f"❌ Erro ao salvar snapshot: {e}"
+            print(erro_msg)
+            return False, erro_msg
         
-        return df_encoded
+        msg = f"💾 Snapshot do índice salvo em {destino}"
+        print(msg)
+        return True, msg
     
-    def recomendar_acoes(self, cliente, top_n=5):
+    @classmethod
+    def salvar_cache_dados(cls, dados_processados, diretorio, caminho_csv, relatorio=None):
         """
-        Recomenda ações similares baseado na carteira do cliente e retorna string com resultados
+        Salva os dados pré-processados em `diretorio` (Feather com pyarrow, senão um .npy por coluna)
+        para que outros processos não precisem reler e limpar o CSV
         """
-        buffer = f"\n🎯 Gerando recomendações para {cliente.nome}...\n"
-        print(f"\n🎯 Gerando recomendações para {cliente.nome}...")
+        hash_csv = hash_screeners(caminho_csv, diretorio)
+        base = os.path.join(diretorio, f"dados-v{cls.FORMATO_CACHE_DADOS}-{hash_csv[:16]}")
+        nome_base = os.path.basename(base)
         
-        symbols_entrada = cliente.carteira.tickers
-        pesos = cliente.carteira.quantidades
+        def gravar_feather(temporario):
+            tabela = pyarrow.Table.from_pandas(dados_processados, preserve_index=False)
+            pyarrow.feather.write_feather(tabela, temporario, compression='uncompressed')
         
-        # Verificar se temos a coluna PC para filtrar performance positiva
-        if 'PC' in self.dados_processados.columns:
-            df_filtered = self.dados_processados[self.dados_processados['PC'] > 0].copy()
-        else:
-            # Se não temos PC, usar todos os dados
-            df_filtered = self.dados_processados.copy()
-            buffer += "⚠️ Usando todos os dados (coluna PC não disponível)\n"
-            print("⚠️ Usando todos os dados (coluna PC não disponível)")
+        def gravar_coluna(array):
+            def gravar(temporario):
+                with open(temporario, 'wb') as arquivo:
+                    np.save(arquivo, array, allow_pickle=False)
+            return gravar
         
-        if df_filtered.empty:
-            buffer += "⚠️ Nenhuma ação disponível para recomendação\n"
-            print("⚠️ Nenhuma ação disponível para recomendação")
-            return buffer
+        try:
+            if PYARROW_DISPONIVEL:
+                gravar_atomico(f"{base}.feather", gravar_feather)
+                arquivos = {'arquivo': f"{nome_base}.feather"}
+            else:
+                colunas = []
+                for i, coluna in enumerate(dados_processados.columns):
+                    serie = dados_processados[coluna]
+                    entrada = {'nome': coluna, 'tipo': str(serie.dtype), 'arquivo': f"{nome_base}-{i}.npy",
+                               'ausentes': None}
+                    if serie.dtype.kind in 'biuf':
+                        array = serie.to_numpy()
+                    else:
+                        ausentes = serie.isna().to_numpy()
+                        array = serie.fillna('').to_numpy(dtype=str)
+                        if ausentes.any():
+                            entrada['ausentes'] = f"{nome_base}-{i}-ausentes.npy"
+                            gravar_atomico(os.path.join(diretorio, entrada['ausentes']), gravar_coluna(ausentes))
+                    gravar_atomico(os.path.join(diretorio, entrada['arquivo']), gravar_coluna(array))
+                    colunas.append(entrada)
+                arquivos = {'colunas': colunas}
+            
+            def gravar_manifest(temporario):
+                manifest = {
+                    'formato': cls.FORMATO_CACHE_DADOS,
+                    'hash_csv': hash_csv,
+                    **arquivos,
+                    'n_linhas': len(dados_processados),
+                    'relatorio': [] if relatorio is None else relatorio.astype(object).where(
+                        relatorio.notna(), None).to_dict(orient='records'),
+                    'colunas_relatorio': (['linha', 'Symbol', 'coluna', 'valor', 'motivo', 'Exchange']
+                                          if relatorio is None else list(relatorio.columns)),
+                    'criado_em': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                }
+                with open(temporario, 'w', encoding='utf-8') as arquivo:
+                    json.dump(manifest, arquivo, ensure_ascii=False, default=str)
+            
+            # Manifest por último: só aparece com os dados completos
+            gravar_atomico(f"{base}.json", gravar_manifest)
+        except (OSError, ValueError, TypeError) as e:
+            erro_msg = f"❌ Erro ao salvar cache dos dados: {e}"
+            print(erro_msg)
+            return False, erro_msg
         
-        # Criar features para todos os dados
-        df_features = self._criar_features(df_filtered)
+        msg = f"💾 Cache dos dados pré-processados salvo em {base}.json"
+        print(msg)
+        return True, msg
+    
+    @classmethod
+    def _ler_manifest_cache(cls, diretorio, caminho_csv):
+        """Manifest do cache dos dados para o conteúdo atual do CSV, ou None"""
+        if not diretorio or not os.path.isdir(diretorio):
+            return None
+        hash_csv = hash_screeners(caminho_csv, diretorio)
+        caminho_manifest = os.path.join(diretorio, f"dados-v{cls.FORMATO_CACHE_DADOS}-{hash_csv[:16]}.json")
+        try:
+            with open(caminho_manifest, encoding='utf-8') as arquivo:
+                manifest = json.load(arquivo)
+        except (OSError, ValueError):
+            return None
+        return manifest if manifest.get('hash_csv') == hash_csv else None
+    
+    @staticmethod
+    def _relatorio_manifest(manifest):
+        """Relatório de rejeitados guardado no manifest do cache, com as mesmas colunas"""
+        return pd.DataFrame(manifest.get('relatorio', []), columns=manifest.get('colunas_relatorio'))
+    
+    @classmethod
+    def carregar_relatorio_cache(cls, diretorio, caminho_csv):
+        """Só o relatório de rejeitados do cache do CSV informado (ou None), sem ler os dados"""
+        manifest = cls._ler_manifest_cache(diretorio, caminho_csv)
+        return None if manifest is None else cls._relatorio_manifest(manifest)
+    
+    @classmethod
+    def carregar_cache_dados(cls, diretorio, caminho_csv):
+        """
+        Carrega os dados pré-processados do CSV informado, se houver cache para
+        o conteúdo atual (tamanho e mtime evitam recalcular o hash). Retorna
+        (DataFrame, relatório de rejeitados) ou None.
+        """
+        manifest = cls._ler_manifest_cache(diretorio, caminho_csv)
+        if manifest is None:
+            return None
         
-        if df_features.empty:
-            buffer += "❌ Não foi possível criar features para recomendação\n"
-            print("❌ Não foi possível criar features para recomendação")
-            return buffer
+        try:
+            if 'arquivo' in manifest:
+                if not PYARROW_DISPONIVEL:
+                    return None
+                origem = os.path.join(diretorio, manifest['arquivo'])
+                tabela = pyarrow.feather.read_table(origem, memory_map=True)
+                dados = tabela.to_pandas(split_blocks=True)
+            else:
+                origem = diretorio
+                colunas = {}
+                for entrada in manifest['colunas']:
+                    array = np.load(os.path.join(diretorio, entrada['arquivo']), mmap_mode='r',
+                                    allow_pickle=False)
+                    if array.dtype.kind not in 'biuf':
+                        array = array.astype(object)
+                        if entrada['ausentes']:
+                            array[np.load(os.path.join(diretorio, entrada['ausentes']), allow_pickle=False)] = None
+                    colunas[entrada['nome']] = pd.Series(array, dtype=entrada['tipo'], copy=False)
+                dados = pd.DataFrame(colunas, copy=False)
+                if len(dados) != manifest['n_linhas']:
+                    raise ValueError(f"{len(dados)} linhas, esperadas {manifest['n_linhas']}")
+        except (OSError, ValueError, TypeError, KeyError, ImportError) as e:
+            print(f"⚠️ Cache dos dados ilegível ({e}), ignorado")
+            return None
+        
+        print(f"⚡ Dados pré-processados carregados do cache {origem}: {len(dados)} ativos")
+        return dados, cls._relatorio_manifest(manifest)
+    
+    @classmethod
+    def carregar_snapshot(cls, diretorio, caminho_csv, modo='esparso', compacto=False):
+        """
+        Carrega o snapshot do CSV informado com np.load(mmap_mode='r') (páginas divididas entre processos)
+        Retorna None se não houver snapshot para o conteúdo atual do CSV
+        """
+        if modo not in cls.MODOS_PONTUACAO:
+            raise ValueError(f"Modo de pontuação inválido: {modo} (use {cls.MODOS_PONTUACAO})")
+        
+        if not os.path.isdir(diretorio):
+            return None
+        hash_csv = hash_screeners(caminho_csv, diretorio)
+        origem = os.path.join(diretorio, f"v{cls.FORMATO_SNAPSHOT}-{hash_csv[:16]}")
+        caminho_manifest = os.path.join(origem, 'manifest.json')
+        if not os.path.exists(caminho_manifest):
+            return None
+        
+        with open(caminho_manifest, encoding='utf-8') as arquivo:
+            manifest = json.load(arquivo)
+        if manifest.get('formato') != cls.FORMATO_SNAPSHOT or manifest.get('hash_csv') != hash_csv:
+            print("⚠️ Snapshot incompatível com o CSV atual, ignorado")
+            return None
+        
+        sistema = cls.__new__(cls)
+        sistema.modo = modo
+        sistema.compacto = compacto
+        sistema.embeddings = None
+        sistema.indice_ann = None
+        sistema.vizinhos_linhas = None
+        sistema.vizinhos_scores = None
+        sistema.pool_fragmentos = None
+        sistema.geracao = 0
+        sistema.dados_nasdaq = None
+        sistema.dados_processados = None
+        sistema.matriz_normalizada = None
+        for nome in cls.ARRAYS_SNAPSHOT:
+            setattr(sistema, nome, np.load(os.path.join(origem, f"{nome}.npy"), mmap_mode='r'))
+        sistema.colunas_categoricas = manifest['colunas_categoricas']
+        sistema.categorias = [np.asarray(cats, dtype=object) for cats in manifest['categorias']]
+        sistema.colunas_numericas = manifest['colunas_numericas']
+        sistema.colunas_filtro = manifest['colunas_filtro']
+        sistema._finalizar_indice(normas=sistema.normas)
+        
+        print(f"⚡ Snapshot do índice carregado de {origem}: {len(sistema.simbolos)} ativos "
+              f"({int(sistema.mascara_elegivel.sum())} elegíveis)")
+        return sistema
+    
+    def _chave_vetores(self):
+        """
+        Arrays de que depende o vetor de uma carteira neste índice; o cache da
+        Carteira vale enquanto forem os mesmos objetos
+        """
+        return (self.valores_normalizados, self.pesos_categorias, self.mascara_elegivel, self.indice_simbolos,
+                self.embeddings)
+    
+    def _estado_carteira(self, carteira):
+        """(linhas elegíveis em ordem, pesos, vetor médio) da carteira, a partir do cache dela"""
+        pesos_por_linha, soma, total = carteira.vetor_ponderado(self)
+        linhas = sorted(pesos_por_linha)
+        pesos = np.array([pesos_por_linha[linha] for linha in linhas], dtype=float)
+        return linhas, pesos, (soma / total if total > 0 else soma.copy())
+    
+    def _vetor_carteira(self, linhas, pesos):
+        """Soma ponderada das features das linhas da carteira"""
+        return self._agregar_linhas(linhas, np.zeros(len(linhas), dtype=np.int64), 1, pesos)[0]
+    
+    def _linhas_simbolos(self, simbolos):
+        """Linhas do índice dos símbolos conhecidos (ignora os ausentes)"""
+        return [self.indice_simbolos[s] for s in simbolos if s in self.indice_simbolos]
+    
+    def _linhas_carteira(self, carteira):
+        """
+        Linhas elegíveis do índice presentes na carteira e seus pesos
+        (para símbolos repetidos vale a primeira quantidade)
+        """
+        pesos_por_linha = {}
+        for symbol, peso in zip(carteira.tickers, carteira.quantidades):
+            linha = self.indice_simbolos.get(symbol)
+            if linha is not None and self.mascara_elegivel[linha]:
+                pesos_por_linha.setdefault(linha, peso)
+        
+        linhas = sorted(pesos_por_linha)
+        pesos = np.array([pesos_por_linha[linha] for linha in linhas], dtype=float)
+        return linhas, pesos
+    
+    def _pontuar(self, vetor_entrada, linhas=None):
+        """
+        Calcula a similaridade do cosseno do vetor com as linhas do índice
+        (todas, ou só as `linhas` informadas, na mesma ordem)
+        """
+        n_linhas = len(self.simbolos) if linhas is None else len(linhas)
+        norma_entrada = np.linalg.norm(vetor_entrada)
+        if norma_entrada == 0:
+            return np.zeros(n_linhas)
+        vetor_unitario = vetor_entrada / norma_entrada
+        
+        selecao = slice(None) if linhas is None else linhas
+        if self.modo == 'esparso':
+            produto = self.matriz_normalizada.produto_vetor(vetor_unitario, linhas)
+            if self.embeddings is not None:
+                produto += ((self.embeddings[selecao] @ vetor_unitario[self.offsets_numericas_fim:])
+                            * self.inverso_normas[selecao])
+            return produto
+        
+        produto = np.zeros(n_linhas)
+        for j, offset in enumerate(self.offsets_categorias):
+            codigos = self.codigos_categorias[selecao, j]
+            produto += vetor_unitario[offset:offset + len(self.categorias[j])][codigos] * self.pesos_categorias[j]
+        produto += (self.valores_normalizados[selecao]
+                    @ vetor_unitario[self.offsets_categorias_fim:self.offsets_numericas_fim])
+        if self.embeddings is not None:
+            produto += self.embeddings[selecao] @ vetor_unitario[self.offsets_numericas_fim:]
+        return produto * self.inverso_normas[selecao]
+    
+    def _ranquear(self, vetor_entrada, linhas_excluidas, top_n, candidatos=None):
+        """
+        Pontua o vetor (contra todo o índice ou só contra `candidatos`, em ordem
+        crescente) e retorna (linhas, pontuações) das top_n linhas elegíveis
+        fora de `linhas_excluidas`
+        """
+        if candidatos is None and self.pool_fragmentos is not None:
+            parciais = self._ranquear_fragmentos(vetor_entrada[None, :], [linhas_excluidas], top_n)
+            if parciais is not None:
+                return parciais[0]
+        
+        linhas, scores = self._pontuar_candidatos(vetor_entrada, linhas_excluidas, candidatos)
+        posicoes, valores = selecionar_top_n(scores, top_n)
+        return linhas[posicoes[0]], valores[0]
+    
+    def _ranquear_fragmentos(self, vetores_entrada, excluidas, top_n):
+        """
+        Ranqueia vários vetores (um por linha) contra todo o universo no pool
+        de fragmentos; os pesos do perfil entram no próprio vetor consultado.
+        Retorna None se o pool já foi encerrado.
+        """
+        pool = self.pool_fragmentos
+        if pool is None:
+            return None
+        normas_entrada = np.linalg.norm(vetores_entrada, axis=1)
+        unitarios = (vetores_entrada / np.where(normas_entrada == 0, 1.0, normas_entrada)[:, None]).T.copy()
+        for j, offset in enumerate(self.offsets_categorias):
+            unitarios[offset:offset + len(self.categorias[j])] *= self.pesos_categorias[j]
+        unitarios[self.offsets_categorias_fim:self.offsets_numericas_fim] *= self.pesos_numericos[:, None]
+        return pool.ranquear(unitarios, self.perfil_indice, excluidas, top_n)
+    
+    def iniciar_pool_fragmentos(self, n_processos=None, n_fragmentos=None):
+        """
+        Divide o índice em fragmentos na memória compartilhada e abre um pool de processos para
+        a varredura completa e o modo em lote; atualizações no lugar refazem o pool
+        """
+        if self.codigos_categorias is None:
+            print("⚠️ Índice de recomendação vazio, pool não iniciado")
+            return False
+        self.encerrar_pool_fragmentos()
+        self.pool_fragmentos = PoolFragmentos(self, n_processos, n_fragmentos)
+        print(f"🧩 Pool de pontuação: {len(self.pool_fragmentos.fragmentos)} fragmentos em "
+              f"{self.pool_fragmentos.n_processos} processos")
+        return True
+    
+    def encerrar_pool_fragmentos(self):
+        """Encerra o pool de fragmentos, se houver"""
+        if self.pool_fragmentos is not None:
+            self.pool_fragmentos.encerrar()
+            self.pool_fragmentos = None
+    
+    def _reconstruir_pool_fragmentos(self):
+        """Troca o pool (se houver) por um novo, com a mesma configuração, sobre os arrays atuais"""
+        pool = self.pool_fragmentos
+        if pool is not None:
+            self.encerrar_pool_fragmentos()
+            self.iniciar_pool_fragmentos(pool.n_processos, len(pool.fragmentos))
+    
+    def _pontuar_candidatos(self, vetor_entrada, linhas_excluidas, candidatos=None):
+        """
+        Pontua o vetor contra os candidatos (por padrão, todo o índice) e
+        retorna (linhas, pontuações), com -inf nos inelegíveis e excluídos
+        """
+        scores = self._pontuar(vetor_entrada, candidatos)
         
-        # Filtrar ações da carteira do cliente
-        df_input = df_features[df_features['Symbol'].isin(symbols_entrada)].copy()
+        if candidatos is None:
+            scores[~self.mascara_elegivel] = -np.inf
+            scores[linhas_excluidas] = -np.inf
+            return np.arange(len(scores)), scores
         
-        if df_input.empty:
-            buffer += "⚠️ Nenhum símbolo da carteira encontrado nos dados\n"
-            print("⚠️ Nenhum símbolo da carteira encontrado nos dados")
-            # Mostrar símbolos disponíveis para debug
-            simbolos_disponiveis = df_features['Symbol'].head(10).tolist()
-            debug_info = f"📋 Primeiros símbolos disponíveis: {simbolos_disponiveis}\n"
-            buffer += debug_info
-            print(debug_info.strip())
-            return buffer
+        candidatos = np.asarray(candidatos)
+        scores[~self.mascara_elegivel[candidatos] | np.isin(candidatos, linhas_excluidas)] = -np.inf
+        return candidatos, scores
+    
+    def _pontuar_lote(self, vetores_entrada):
+        """
+        Similaridade do cosseno de vários vetores (um por linha) com todas as
+        linhas do índice em um único produto matricial; retorna n_ativos x n_vetores
+        """
+        normas_entrada = np.linalg.norm(vetores_entrada, axis=1)
+        unitarios = (vetores_entrada / np.where(normas_entrada == 0, 1.0, normas_entrada)[:, None]).T
+        
+        if self.modo == 'esparso':
+            produto = self.matriz_normalizada.produto_matriz(unitarios)
+            if self.embeddings is not None:
+                produto += ((self.embeddings @ unitarios[self.offsets_numericas_fim:])
+                            * self.inverso_normas[:, None])
+            return produto
+        
+        produto = np.zeros((len(self.simbolos), unitarios.shape[1]))
+        for j, offset in enumerate(self.offsets_categorias):
+            produto += (unitarios[offset:offset + len(self.categorias[j])][self.codigos_categorias[:, j]]
+                        * self.pesos_categorias[j])
+        produto += self.valores_normalizados @ unitarios[self.offsets_categorias_fim:self.offsets_numericas_fim]
+        if self.embeddings is not None:
+            produto += self.embeddings @ unitarios[self.offsets_numericas_fim:]
+        return produto * self.inverso_normas[:, None]
+    
+    def _ranquear_podado(self, vetor_entrada, linhas_excluidas, top_n):
+        """Mesmo resultado de _ranquear, pontuando só os ativos que compartilham categorias com a carteira"""
+        n_cat = len(self.colunas_categoricas)
+        soma_categorias = float(np.sum(self.pesos_categorias ** 2))
+        norma_entrada = np.linalg.norm(vetor_entrada)
+        if (soma_categorias == 0 or norma_entrada == 0 or top_n <= 0
+                or len(self.simbolos) < self.MINIMO_LINHAS_PODA or self.embeddings is not None):
+            return self._ranquear(vetor_entrada, linhas_excluidas, top_n)
+        
+        vetor_unitario = vetor_entrada / norma_entrada
+        pesos_categorias = [vetor_unitario[offset:offset + len(self.categorias[j])]
+                            for j, offset in enumerate(self.offsets_categorias)]
+        codigos_carteira = [np.flatnonzero(pesos > 0) for pesos in pesos_categorias]
+        tamanhos_listas = [int((self.invertido_inicios[j][codigos + 1] - self.invertido_inicios[j][codigos]).sum())
+                           for j, codigos in enumerate(codigos_carteira)]
+        maximos = [float(pesos.max()) * self.pesos_categorias[j] if len(pesos) else 0.0
+                   for j, pesos in enumerate(pesos_categorias)]
+        norma_numerica = np.linalg.norm(vetor_unitario[self.offsets_categorias_fim:])
+        norma_maxima_numerica = np.linalg.norm(self.pesos_numericos)
+        
+        # Candidatos do índice invertido, uma categórica por vez (listas menores primeiro)
+        usadas = []
+        for j in np.argsort(tamanhos_listas, kind='stable'):
+            if self.pesos_categorias[j] == 0:
+                continue
+            usadas.append(j)
+            if sum(tamanhos_listas[u] for u in usadas) > self.FRACAO_MAXIMA_PODA * len(self.simbolos):
+                break
+            
+            candidatos = np.unique(np.concatenate(
+                [self.invertido_ordem[u][self.invertido_inicios[u][c]:self.invertido_inicios[u][c + 1]]
+                 for u in usadas for c in codigos_carteira[u]]))
+            
+            # Limite da pontuação de quem ficou de fora: zero nas categóricas usadas, o
+            # maior peso da carteira nas demais e a parte numérica (valores em [0, peso])
+            # por Cauchy-Schwarz; embeddings não têm limite, por isso desligam a poda
+            m = sum(maximos[u] for u in range(n_cat) if u not in usadas)
+            t = (norma_maxima_numerica if m == 0
+                 else min(max(norma_numerica * soma_categorias / m, 0.0), norma_maxima_numerica))
+            limite = (m + norma_numerica * t) / np.sqrt(soma_categorias + t * t)
+            
+            # Se o top_n-ésimo candidato supera o limite, ninguém de fora entraria
+            linhas, valores = self._ranquear(vetor_entrada, linhas_excluidas, top_n, candidatos)
+            if len(linhas) == top_n and valores[-1] > limite + 1e-12:
+                return linhas, valores
+        
+        return self._ranquear(vetor_entrada, linhas_excluidas, top_n)
+    
+    def treinar_embeddings_colaborativos(self, clientes, n_fatores=32, peso=1.0,
+                                         n_iteracoes_potencia=2, semente=0):
+        """
+        Tarefa offline: embeddings das ações (SVD da matriz clientes x ações) que viram colunas
+        extras das features, com norma `peso`
+        """
+        dados, indices, indptr = [], [], [0]
+        for cliente in clientes:
+            pesos_por_linha = {}
+            for symbol, quantidade in zip(cliente.carteira.tickers, cliente.carteira.quantidades):
+                linha = self.indice_simbolos.get(symbol)
+                if linha is not None and quantidade > 0:
+                    pesos_por_linha.setdefault(linha, np.log1p(quantidade))
+            if not pesos_por_linha:
+                continue
+            valores = np.array(list(pesos_por_linha.values()))
+            dados.extend((valores / np.linalg.norm(valores)).tolist())
+            indices.extend(pesos_por_linha)
+            indptr.append(len(dados))
+        
+        if len(indptr) < 3:
+            print("⚠️ Carteiras insuficientes para treinar embeddings colaborativos")
+            return False
+        
+        print(f"🤝 Treinando embeddings colaborativos ({len(indptr) - 1} clientes, {len(dados)} posições)...")
+        matriz = MatrizEsparsaCSR(dados, np.array(indices, dtype=np.int64), indptr, len(self.simbolos))
+        valores_singulares, fatores = svd_truncado_aleatorio(matriz, n_fatores, n_iteracoes_potencia,
+                                                             semente=semente)
+        embeddings = fatores * np.sqrt(valores_singulares)
+        normas = np.linalg.norm(embeddings, axis=1)
+        embeddings = embeddings / np.where(normas == 0, 1.0, normas)[:, None] * peso
+        
+        self._ativar_embeddings(embeddings)
+        print(f"✅ Embeddings colaborativos: {embeddings.shape[1]} fatores, "
+              f"{int((normas > 0).sum())} ações com sinal")
+        return True
+    
+    def _ativar_embeddings(self, embeddings):
+        """Acrescenta (ou troca) as colunas colaborativas e refaz normas e estruturas derivadas"""
+        n_anteriores = 0 if self.embeddings is None else self.embeddings.shape[1]
+        self.embeddings = np.asarray(embeddings, dtype=self.tipo_features)
+        self.colunas_features = (self.colunas_features[:self.offsets_numericas_fim] +
+                                 [f"CF_{i}" for i in range(embeddings.shape[1])])
+        self._atualizar_normas()
+        
+        # Índice aproximado continua valendo: centroides com zeros nas novas colunas
+        if self.indice_ann is not None:
+            centroides = self.indice_ann.centroides[:, :self.indice_ann.centroides.shape[1] - n_anteriores]
+            centroides = np.hstack([centroides, np.zeros((len(centroides), embeddings.shape[1]))])
+            self.indice_ann = IndiceIVF(centroides, self.indice_ann.grupos, self.indice_ann.n_sondas)
+        self.cache_similares = CacheLRU(self.CAPACIDADE_CACHE_SIMILARES)
+        self._reconstruir_pool_fragmentos()
+        self.geracao += 1
+    
+    def salvar_embeddings(self, caminho="./dados_investimentos/embeddings.npz"):
+        """Persiste os embeddings colaborativos junto com os símbolos"""
+        if self.embeddings is None:
+            print("⚠️ Nenhum embedding colaborativo para salvar")
+            return False
+        os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+        np.savez(caminho, simbolos=np.asarray(self.simbolos, dtype=str), embeddings=self.embeddings)
+        print(f"💾 Embeddings colaborativos salvos em {caminho}")
+        return True
+    
+    def carregar_embeddings(self, caminho="./dados_investimentos/embeddings.npz"):
+        """Carrega embeddings salvos, alinhando pelos símbolos (ações novas ficam sem sinal)"""
+        if not os.path.exists(caminho):
+            print(f"⚠️ Embeddings não encontrados em {caminho}")
+            return False
+        with np.load(caminho) as dados:
+            simbolos, salvos = dados['simbolos'], dados['embeddings']
+        linhas_salvas = {simbolo: i for i, simbolo in enumerate(simbolos.tolist())}
+        embeddings = np.zeros((len(self.simbolos), salvos.shape[1]))
+        for linha, simbolo in enumerate(self.simbolos.tolist()):
+            if simbolo in linhas_salvas:
+                embeddings[linha] = salvos[linhas_salvas[simbolo]]
+        self._ativar_embeddings(embeddings)
+        print(f"✅ Embeddings colaborativos carregados de {caminho}")
+        return True
+    
+    def construir_indice_ann(self, n_grupos=None, n_sondas=8, n_iteracoes=10, semente=0):
+        """Constrói o índice aproximado (IVF) usado por recomendar_acoes"""
+        if self.codigos_categorias is None:
+            print("⚠️ Índice de recomendação vazio, índice aproximado não construído")
+            return None
+        print("🧭 Construindo índice aproximado (IVF)...")
+        self.indice_ann = IndiceIVF.construir(self, n_grupos, n_sondas, n_iteracoes, semente)
+        self.geracao += 1
+        print(f"✅ Índice aproximado: {len(self.indice_ann.centroides)} grupos, "
+              f"{self.indice_ann.n_sondas} sondas por consulta")
+        return self.indice_ann
+    
+    def salvar_indice_ann(self, caminho="./dados_investimentos/indice_ann.npz"):
+        """Persiste o índice aproximado em disco"""
+        if self.indice_ann is None:
+            print("⚠️ Nenhum índice aproximado para salvar")
+            return False
+        os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+        self.indice_ann.salvar(caminho)
+        print(f"💾 Índice aproximado salvo em {caminho}")
+        return True
+    
+    def carregar_indice_ann(self, caminho="./dados_investimentos/indice_ann.npz"):
+        """Carrega um índice aproximado salvo, se for compatível com o índice atual"""
+        if not os.path.exists(caminho):
+            print(f"⚠️ Índice aproximado não encontrado em {caminho}")
+            return False
+        indice = IndiceIVF.carregar(caminho)
+        if (len(indice.grupos) != len(self.simbolos)
+                or indice.centroides.shape[1] != len(self.colunas_features)):
+            print("⚠️ Índice aproximado incompatível com os dados atuais, ignorado")
+            return False
+        self.indice_ann = indice
+        self.geracao += 1
+        print(f"✅ Índice aproximado carregado de {caminho}")
+        return True
+    
+    def relatorio_ann(self, carteiras=None, top_n=10, sondas=(1, 2, 4, 8, 16), n_amostras=200,
+                      semente=0):
+        """
+        Compara o índice aproximado com a busca exata: recall@top_n e latência por número de sondas
+        Sem `carteiras`, usa ativos elegíveis sorteados como carteiras de um ativo
+        """
+        if self.indice_ann is None:
+            erro_msg = "❌ Índice aproximado não construído"
+            print(erro_msg)
+            return erro_msg
         
-        # Remover coluna Symbol para cálculo de similaridade
-        symbols_all = df_features['Symbol'].values
-        features_all = df_features.drop('Symbol', axis=1).values
+        if carteiras is None:
+            rng = np.random.default_rng(semente)
+            elegiveis = np.flatnonzero(self.mascara_elegivel)
+            sorteados = rng.choice(elegiveis, min(n_amostras, len(elegiveis)), replace=False)
+            carteiras = [Carteira([self.simbolos[linha]], [1]) for linha in sorteados]
+        
+        consultas = []
+        for carteira in carteiras:
+            linhas, pesos = self._linhas_carteira(carteira)
+            if linhas:
+                consultas.append((self._vetor_carteira(linhas, pesos) / pesos.sum(),
+                                  self._linhas_simbolos(carteira.tickers)))
+        
+        if not consultas:
+            erro_msg = "⚠️ Nenhuma carteira válida para o relatório"
+            print(erro_msg)
+            return erro_msg
+        
+        inicio = time.perf_counter()
+        exatos = [set(self._ranquear(vetor, excluidas, top_n)[0].tolist()) for vetor, excluidas in consultas]
+        ms_exato = (time.perf_counter() - inicio) * 1000 / len(consultas)
+        
+        buffer = f"\n🧭 RELATÓRIO RECALL x LATÊNCIA (IVF, top {top_n}, {len(consultas)} consultas)\n"
+        buffer += "=" * 60 + "\n"
+        buffer += f"   Busca exata: {ms_exato:.3f} ms/consulta\n"
+        for n_sondas in sondas:
+            inicio = time.perf_counter()
+            aproximados = [self._ranquear(vetor, excluidas, top_n,
+                                          self.indice_ann.candidatos(vetor / np.linalg.norm(vetor), n_sondas))[0]
+                           for vetor, excluidas in consultas]
+            ms_ann = (time.perf_counter() - inicio) * 1000 / len(consultas)
+            acertos = [len(exato.intersection(aprox.tolist())) / max(len(exato), 1)
+                       for exato, aprox in zip(exatos, aproximados)]
+            buffer += (f"   {n_sondas:>3} sondas: recall {np.mean(acertos):.3f} | "
+                       f"{ms_ann:.3f} ms/consulta\n")
         
-        symbols_input = df_input['Symbol'].values
-        features_input = df_input.drop('Symbol', axis=1).values
+        print(buffer.strip())
+        return buffer
+    
+    def construir_tabela_vizinhos(self, k=50, tamanho_bloco=256):
+        """
+        Tarefa offline: para cada ativo, guarda os k ativos elegíveis mais similares (sem ele mesmo)
+        em arrays int32/float32, pontuando em blocos de `tamanho_bloco` ativos
+        """
+        if self.codigos_categorias is None:
+            print("⚠️ Índice de recomendação vazio, tabela de vizinhos não construída")
+            return False
+        
+        print(f"🕸️ Construindo tabela de {k} vizinhos por ativo...")
+        n_linhas = len(self.simbolos)
+        vizinhos_linhas = np.full((n_linhas, k), -1, dtype=np.int32)
+        vizinhos_scores = np.zeros((n_linhas, k), dtype=np.float32)
+        
+        for inicio in range(0, n_linhas, tamanho_bloco):
+            bloco = np.arange(inicio, min(inicio + tamanho_bloco, n_linhas))
+            vetores = self._agregar_linhas(bloco, np.arange(len(bloco)), len(bloco), normalizar=True)
+            scores = self._pontuar_lote(vetores).T
+            scores[:, ~self.mascara_elegivel] = -np.inf
+            scores[np.arange(len(bloco)), bloco] = -np.inf
+            
+            posicoes, valores = selecionar_top_n(scores, k)
+            for b, (linhas, sims) in enumerate(zip(posicoes, valores)):
+                vizinhos_linhas[inicio + b, :len(linhas)] = linhas
+                vizinhos_scores[inicio + b, :len(linhas)] = sims
+        
+        self.vizinhos_linhas, self.vizinhos_scores = vizinhos_linhas, vizinhos_scores
+        self.geracao += 1
+        print(f"✅ Tabela de vizinhos construída ({(vizinhos_linhas.nbytes + vizinhos_scores.nbytes) / 1e6:.1f} MB)")
+        return True
+    
+    def salvar_tabela_vizinhos(self, caminho="./dados_investimentos/vizinhos.npz"):
+        """Persiste a tabela de vizinhos em disco"""
+        if self.vizinhos_linhas is None:
+            print("⚠️ Nenhuma tabela de vizinhos para salvar")
+            return False
+        os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+        np.savez(caminho, linhas=self.vizinhos_linhas, scores=self.vizinhos_scores)
+        print(f"💾 Tabela de vizinhos salva em {caminho}")
+        return True
+    
+    def carregar_tabela_vizinhos(self, caminho="./dados_investimentos/vizinhos.npz"):
+        """Carrega uma tabela de vizinhos salva, se for compatível com o índice atual"""
+        if not os.path.exists(caminho):
+            print(f"⚠️ Tabela de vizinhos não encontrada em {caminho}")
+            return False
+        with np.load(caminho) as dados:
+            linhas, scores = dados['linhas'], dados['scores']
+        if len(linhas) != len(self.simbolos):
+            print("⚠️ Tabela de vizinhos incompatível com os dados atuais, ignorada")
+            return False
+        self.vizinhos_linhas, self.vizinhos_scores = linhas, scores
+        self.geracao += 1
+        print(f"✅ Tabela de vizinhos carregada de {caminho}")
+        return True
+    
+    def _ranquear_vizinhos(self, linhas_entrada, pesos_entrada, linhas_excluidas, top_n,
+                           mascara=None):
+        """
+        Modo rápido: junta as listas de vizinhos das ações da carteira,
+        somando as similaridades ponderadas pelas quantidades; o custo depende
+        só do tamanho da carteira e de k, não do universo
+        """
+        candidatos, scores = self._pontuar_vizinhos(linhas_entrada, pesos_entrada,
+                                                    linhas_excluidas, mascara)
+        posicoes, valores = selecionar_top_n(scores, top_n)
+        return candidatos[posicoes[0]], valores[0]
+    
+    def _pontuar_vizinhos(self, linhas_entrada, pesos_entrada, linhas_excluidas, mascara=None):
+        """Linhas das listas de vizinhos da carteira e suas pontuações (-inf nas descartadas)"""
+        vizinhos = self.vizinhos_linhas[linhas_entrada].ravel()
+        contribuicoes = (self.vizinhos_scores[linhas_entrada]
+                         * (pesos_entrada / pesos_entrada.sum())[:, None]).ravel()
+        validos = vizinhos >= 0
+        candidatos, inverso = np.unique(vizinhos[validos], return_inverse=True)
+        scores = np.bincount(inverso, weights=contribuicoes[validos], minlength=len(candidatos))
+        
+        # A máscara pode ter mudado depois da construção da tabela
+        if mascara is None:
+            mascara = self.mascara_elegivel
+        scores[~mascara[candidatos] | np.isin(candidatos, linhas_excluidas)] = -np.inf
+        return candidatos, scores
+    
+    def recomendar_lote(self, clientes, top_n=5, tamanho_bloco=128):
+        """
+        Recomenda ações para vários clientes de uma vez, em blocos de `tamanho_bloco`
+        Retorna {id do cliente: {'recomendacoes': [...], 'scores': [...]}}
+        """
+        resultados = {}
+        if self.codigos_categorias is None or not self.mascara_elegivel.any():
+            return {cliente.id: {'recomendacoes': [], 'scores': []} for cliente in clientes}
+        
+        por_perfil = {}
+        for cliente in clientes:
+            perfil = cliente.perfil if cliente.perfil in self.indices_perfil else None
+            por_perfil.setdefault(perfil, []).append(cliente)
+        if list(por_perfil) != [None]:
+            for perfil, grupo in por_perfil.items():
+                indice = self if perfil is None else self._visao_perfil(perfil)
+                resultados.update(indice.recomendar_lote(grupo, top_n, tamanho_bloco))
+            return resultados
+        
+        for inicio in range(0, len(clientes), tamanho_bloco):
+            bloco = clientes[inicio:inicio + tamanho_bloco]
+            
+            vetores = np.zeros((len(bloco), len(self.colunas_features)))
+            linhas_por_cliente = []
+            for b, cliente in enumerate(bloco):
+                linhas, _, vetores[b] = self._estado_carteira(cliente.carteira)
+                linhas_por_cliente.append(linhas)
+            
+            parciais = None
+            if self.pool_fragmentos is not None:
+                parciais = self._ranquear_fragmentos(
+                    vetores, [self._linhas_simbolos(cliente.carteira.tickers) for cliente in bloco], top_n)
+            if parciais is not None:
+                posicoes = [linhas for linhas, _ in parciais]
+                valores = [scores for _, scores in parciais]
+            else:
+                scores = self._pontuar_lote(vetores).T
+                
+                # Excluir inelegíveis e as ações que cada cliente já possui
+                scores[:, ~self.mascara_elegivel] = -np.inf
+                for b, cliente in enumerate(bloco):
+                    scores[b, self._linhas_simbolos(cliente.carteira.tickers)] = -np.inf
+                
+                posicoes, valores = selecionar_top_n(scores, top_n)
+            for b, cliente in enumerate(bloco):
+                if not linhas_por_cliente[b]:
+                    resultados[cliente.id] = {'recomendacoes': [], 'scores': []}
+                    continue
+                resultados[cliente.id] = {
+                    'recomendacoes': self.simbolos[posicoes[b]].tolist(),
+                    'scores': valores[b].tolist()
+                }
         
-        # Calcular vetor médio ponderado da carteira
-        vetor_entrada = np.zeros(features_input.shape[1])
-        total_peso = 0
+        return resultados
+    
+    def similares(self, symbol, top_n=5, filtros=None):
+        """
+        Ações parecidas com um único ticker, sem precisar de Cliente/Carteira (memorizadas por índice)
+        Retorna (string com resultados, símbolos parecidos, pontuações)
+        """
+        buffer = f"\n🔍 Buscando ações parecidas com {symbol}...\n"
+        print(buffer.strip())
         
-        for i, symbol in enumerate(symbols_input):
-            if symbol in symbols_entrada:
-                peso_idx = symbols_entrada.index(symbol)
-                peso = pesos[peso_idx]
-                vetor_entrada += features_input[i] * peso
-                total_peso += peso
+        linha = self.indice_simbolos.get(symbol)
+        if linha is None or self.codigos_categorias is None:
+            erro_msg = f"⚠️ Símbolo {symbol} não encontrado nos dados\n"
+            print(erro_msg.strip())
+            return buffer + erro_msg, [], []
+        
+        chave = (symbol, top_n, json.dumps(filtros, sort_keys=True, default=str))
+        memorizado = self.cache_similares.obter(chave)
+        if memorizado is None:
+            vetor = self._vetor_carteira([linha], np.ones(1))
+            excluidas = self._linhas_simbolos([symbol])
+            if filtros:
+                mascara_filtro = self.indice_filtros.avaliar(filtros) & self.mascara_elegivel
+                linhas_top, scores_top = self._ranquear(vetor, excluidas, top_n, np.flatnonzero(mascara_filtro))
+            else:
+                linhas_top, scores_top = self._ranquear_podado(vetor, excluidas, top_n)
+            memorizado = (self.simbolos[linhas_top].tolist(), scores_top.tolist())
+            self.cache_similares.guardar(chave, memorizado)
         
-        if total_peso > 0:
-            vetor_entrada /= total_peso
+        simbolos_top, scores_top = memorizado
+        if not simbolos_top:
+            msg = "⚠️ Nenhuma ação parecida encontrada\n"
+        else:
+            msg = f"✅ {len(simbolos_top)} ações parecidas com {symbol}: {simbolos_top}\n"
+        print(msg.strip())
+        return buffer + msg, list(simbolos_top), list(scores_top)
+    
+    def _reordenar_mmr(self, linhas, relevancias, top_n, lambda_mmr):
+        """
+        Máxima relevância marginal: escolhe, um a um, o candidato com maior lambda * relevância -
+        (1 - lambda) * maior similaridade com os já escolhidos; retorna (linhas, relevâncias)
+        """
+        n = len(linhas)
+        unitarios = self._agregar_linhas(linhas, np.arange(n), n, normalizar=True)
+        similaridades = unitarios @ unitarios.T
+        
+        pontuacao = lambda_mmr * np.asarray(relevancias, dtype=float)
+        escolhidos = np.empty(min(top_n, n), dtype=np.int64)
+        disponivel = np.ones(n, dtype=bool)
+        # O primeiro é o mais relevante; com embeddings as similaridades podem
+        # ser negativas, então o máximo parte da linha do primeiro escolhido
+        escolhido = int(np.argmax(pontuacao))
+        escolhidos[0] = escolhido
+        disponivel[escolhido] = False
+        maior_similaridade = similaridades[escolhido].copy()
+        for i in range(1, len(escolhidos)):
+            mmr = np.where(disponivel, pontuacao - (1 - lambda_mmr) * maior_similaridade, -np.inf)
+            escolhido = int(np.argmax(mmr))
+            escolhidos[i] = escolhido
+            disponivel[escolhido] = False
+            np.maximum(maior_similaridade, similaridades[escolhido], out=maior_similaridade)
+        return np.asarray(linhas)[escolhidos], np.asarray(relevancias)[escolhidos]
+    
+    def recomendar_acoes(self, cliente, top_n=5, estrategia=None, n_sondas=None, filtros=None,
+                         lambda_mmr=None):
+        """
+        Recomenda ações similares baseado na carteira do cliente
+        Retorna (string com resultados, símbolos recomendados, pontuações)
+        """
+        # estrategia: 'exata' (todo o universo), 'ann' (grupos mais próximos do IVF; padrão
+        # quando construído) ou 'vizinhos' (média das listas da tabela de vizinhos da carteira)
+        # filtros: dict (E) ou lista de dicts (OU) com as chaves de CHAVES_FILTRO, ex.
+        # {'setor': 'Technology', 'preco': (None, 50)}; só as linhas que passam são pontuadas
+        # Perfis com pesos próprios (PESOS_POR_PERFIL) são pontuados no índice do perfil
+        indice = self._visao_perfil(cliente.perfil)
+        if indice is not self:
+            return indice.recomendar_acoes(cliente, top_n, estrategia, n_sondas, filtros, lambda_mmr)
         
-        # Calcular similaridade com todas as ações
-        similaridades = []
-        for i in range(len(features_all)):
-            sim = cosine_similarity_manual(vetor_entrada, features_all[i])
-            similaridades.append(sim)
+        buffer = f"\n🎯 Gerando recomendações para {cliente.nome}...\n"
+        print(f"\n🎯 Gerando recomendações para {cliente.nome}...")
         
-        # Criar DataFrame de resultados
-        df_resultado = pd.DataFrame({
-            'Symbol': symbols_all,
-            'score': similaridades
-        })
+        buffer, consulta = self._preparar_consulta(buffer, cliente, estrategia, n_sondas, filtros)
+        if consulta is None:
+            return buffer, [], []
+        
+        # lambda_mmr < 1 reordena por diversidade (MMR) os CANDIDATOS_MMR mais relevantes;
+        # sem valor, vale LAMBDA_MMR_POR_PERFIL (vazio: desligada). Pontuações seguem o cosseno
+        if lambda_mmr is None:
+            lambda_mmr = self.LAMBDA_MMR_POR_PERFIL.get(cliente.perfil, 1.0)
+        n_ranqueados = top_n if lambda_mmr >= 1 else max(top_n, self.CANDIDATOS_MMR)
+        
+        if consulta['estrategia'] == 'vizinhos':
+            linhas_top, scores_top = self._ranquear_vizinhos(
+                consulta['linhas_entrada'], consulta['pesos_entrada'],
+                consulta['linhas_excluidas'], n_ranqueados, consulta['mascara_filtro'])
+        elif consulta['candidatos'] is None and n_ranqueados == top_n:
+            # Pontuar e selecionar os melhores, excluindo inelegíveis e ações da carteira
+            # (a poda só compensa para listas curtas)
+            linhas_top, scores_top = self._ranquear_podado(consulta['vetor'], consulta['linhas_excluidas'],
+                                                           n_ranqueados)
+        else:
+            linhas_top, scores_top = self._ranquear(consulta['vetor'], consulta['linhas_excluidas'],
+                                                    n_ranqueados, consulta['candidatos'])
         
-        # Excluir ações que já estão na carteira
-        df_resultado = df_resultado[~df_resultado['Symbol'].isin(symbols_entrada)]
+        if lambda_mmr < 1 and len(linhas_top) > 0:
+            linhas_top, scores_top = self._reordenar_mmr(linhas_top, scores_top, top_n, lambda_mmr)
         
-        if df_resultado.empty:
+        if len(linhas_top) == 0:
             buffer += "⚠️ Nenhuma recomendação disponível após filtrar carteira atual\n"
             print("⚠️ Nenhuma recomendação disponível após filtrar carteira atual")
-            return buffer
+            return buffer, [], []
         
-        # Selecionar top_n símbolos
-        top_symbols = df_resultado.nlargest(top_n, 'score')['Symbol'].tolist()
+        top_symbols = self.simbolos[linhas_top].tolist()
+        top_scores = scores_top.tolist()
         
         resultado_final = f"✅ {len(top_symbols)} recomendações geradas: {top_symbols}\n"
         buffer += resultado_final
         print(f"✅ {len(top_symbols)} recomendações geradas: {top_symbols}")
         
-        return buffer, top_symbols
+        return buffer, top_symbols, top_scores
+    
+    def _preparar_consulta(self, buffer, cliente, estrategia, n_sondas, filtros):
+        """
+        Validações e etapas comuns a todas as formas de recomendar (carteira, filtros, candidatos)
+        Retorna (buffer, dict da consulta) ou (buffer, None) quando não há o que recomendar
+        """
+        if estrategia is None:
+            estrategia = 'ann' if self.indice_ann is not None else 'exata'
+        if estrategia not in self.ESTRATEGIAS:
+            raise ValueError(f"Estratégia inválida: {estrategia} (use {self.ESTRATEGIAS})")
+        
+        symbols_entrada = cliente.carteira.tickers
+        
+        # Se não temos PC, a máscara de elegibilidade cobre todos os dados
+        if 'PC' not in self.colunas_numericas:
+            buffer += "⚠️ Usando todos os dados (coluna PC não disponível)\n"
+            print("⚠️ Usando todos os dados (coluna PC não disponível)")
+        
+        if not self.mascara_elegivel.any():
+            buffer += "⚠️ Nenhuma ação disponível para recomendação\n"
+            print("⚠️ Nenhuma ação disponível para recomendação")
+            return buffer, None
+        
+        if self.codigos_categorias is None:
+            buffer += "❌ Não foi possível criar features para recomendação\n"
+            print("❌ Não foi possível criar features para recomendação")
+            return buffer, None
+        
+        # Ações elegíveis da carteira e vetor médio ponderado (em cache na carteira)
+        linhas_entrada, pesos_entrada, vetor_entrada = self._estado_carteira(cliente.carteira)
+        
+        if not linhas_entrada:
+            buffer += "⚠️ Nenhum símbolo da carteira encontrado nos dados\n"
+            print("⚠️ Nenhum símbolo da carteira encontrado nos dados")
+            # Mostrar símbolos disponíveis para debug
+            simbolos_disponiveis = self.simbolos[self.mascara_elegivel][:10].tolist()
+            debug_info = f"📋 Primeiros símbolos disponíveis: {simbolos_disponiveis}\n"
+            buffer += debug_info
+            print(debug_info.strip())
+            return buffer, None
+        
+        linhas_excluidas = self._linhas_simbolos(symbols_entrada)
+        
+        # Universo filtrado pelos índices de bits
+        mascara_filtro = None
+        if filtros:
+            mascara_filtro = self.indice_filtros.avaliar(filtros) & self.mascara_elegivel
+            info_filtro = f"🔎 Filtros {filtros}: {int(mascara_filtro.sum())} ações elegíveis\n"
+            buffer += info_filtro
+            print(info_filtro.strip())
+            if not mascara_filtro.any():
+                buffer += "⚠️ Nenhuma ação atende aos filtros\n"
+                print("⚠️ Nenhuma ação atende aos filtros")
+                return buffer, None
+        
+        if estrategia == 'vizinhos' and self.vizinhos_linhas is None:
+            aviso = "⚠️ Tabela de vizinhos não construída, usando busca exata\n"
+            buffer += aviso
+            print(aviso.strip())
+            estrategia = 'exata'
+        
+        # Candidatos: todo o universo ou os grupos mais próximos do índice IVF,
+        # restritos às linhas que passam no filtro
+        candidatos = None
+        if estrategia == 'ann' and self.indice_ann is not None and np.any(vetor_entrada):
+            candidatos = self.indice_ann.candidatos(vetor_entrada / np.linalg.norm(vetor_entrada), n_sondas)
+        if mascara_filtro is not None:
+            candidatos = (np.flatnonzero(mascara_filtro) if candidatos is None
+                          else candidatos[mascara_filtro[candidatos]])
+        
+        return buffer, {
+            'estrategia': estrategia,
+            'linhas_entrada': linhas_entrada,
+            'pesos_entrada': pesos_entrada,
+            'vetor': vetor_entrada,
+            'linhas_excluidas': linhas_excluidas,
+            'mascara_filtro': mascara_filtro,
+            'candidatos': candidatos
+        }
+    
+    def cursor_recomendacoes(self, cliente, estrategia=None, n_sondas=None, filtros=None,
+                             validade=300):
+        """
+        Abre um cursor com todas as recomendações do cliente em ordem de ranking (pontuadas uma vez)
+        Retorna (string com resultados, CursorRecomendacoes ou None)
+        """
+        indice = self._visao_perfil(cliente.perfil)
+        if indice is not self:
+            return indice.cursor_recomendacoes(cliente, estrategia, n_sondas, filtros, validade)
+        
+        buffer = f"\n🎯 Abrindo cursor de recomendações para {cliente.nome}...\n"
+        print(buffer.strip())
+        
+        buffer, consulta = self._preparar_consulta(buffer, cliente, estrategia, n_sondas, filtros)
+        if consulta is None:
+            return buffer, None
+        
+        if consulta['estrategia'] == 'vizinhos':
+            linhas, scores = self._pontuar_vizinhos(consulta['linhas_entrada'], consulta['pesos_entrada'],
+                                                    consulta['linhas_excluidas'], consulta['mascara_filtro'])
+        else:
+            linhas, scores = self._pontuar_candidatos(consulta['vetor'], consulta['linhas_excluidas'],
+                                                      consulta['candidatos'])
+        
+        cursor = CursorRecomendacoes(self.simbolos, linhas, scores, validade)
+        msg = f"✅ Cursor aberto: {cursor.restantes()} recomendações ranqueadas\n"
+        buffer += msg
+        print(msg.strip())
+        return buffer, cursor
+    
+    def iterar_recomendacoes(self, cliente, estrategia=None, n_sondas=None, filtros=None):
+        """Gera (símbolo, pontuação) em ordem de ranking, sob demanda"""
+        _, cursor = self.cursor_recomendacoes(cliente, estrategia, n_sondas, filtros)
+        if cursor is not None:
+            yield from cursor
+
+class CursorRecomendacoes:
+    """Recomendações já pontuadas de um cliente, entregues em ordem de ranking a partir de um heap"""
+    def __init__(self, simbolos, linhas, scores, validade=300):
+        validos = np.isfinite(scores)
+        self._heap = list(zip((-scores[validos]).tolist(), np.asarray(linhas)[validos].tolist()))
+        heapq.heapify(self._heap)
+        self.simbolos = simbolos
+        self.entregues = 0
+        self.validade = validade                 # Segundos sem uso até expirar
+        self.ultimo_acesso = time.time()
+        self._trava = threading.Lock()
+    
+    def expirado(self, agora=None):
+        return (agora or time.time()) - self.ultimo_acesso > self.validade
+    
+    def restantes(self):
+        return len(self._heap)
+    
+    def proximos(self, n=5):
+        """Retorna (símbolos, pontuações) dos próximos n itens do ranking"""
+        with self._trava:
+            itens = [heapq.heappop(self._heap) for _ in range(min(n, len(self._heap)))]
+            self.entregues += len(itens)
+            self.ultimo_acesso = time.time()
+        return [self.simbolos[linha] for _, linha in itens], [-score for score, _ in itens]
+    
+    def __iter__(self):
+        while True:
+            simbolos, scores = self.proximos(1)
+            if not simbolos:
+                return
+            yield simbolos[0], scores[0]
+
+class IndiceVersionado:
+    """Guarda a versão atual do SistemaRecomendacao com troca atômica (buffer duplo)"""
+    def __init__(self, sistema=None):
+        self._atual = (0 if sistema is None else 1, sistema)
+        self._trava_construcao = threading.Lock()   # Uma construção por vez
+        self._thread = None
+    
+    def atual(self):
+        """Retorna a tupla (versão, sistema) vigente"""
+        return self._atual
+    
+    @property
+    def versao(self):
+        return self._atual[0]
+    
+    @property
+    def sistema(self):
+        return self._atual[1]
+    
+    def publicar(self, sistema):
+        """Publica um sistema já construído como nova versão"""
+        with self._trava_construcao:
+            return self._publicar(sistema)
+    
+    def _publicar(self, sistema):
+        # A nova versão herda a configuração do pool da anterior, que é encerrado após a troca
+        anterior = self._atual[1]
+        pool = None if anterior is None else anterior.pool_fragmentos
+        if pool is not None and sistema is not None and sistema is not anterior:
+            if sistema.pool_fragmentos is pool:
+                sistema.pool_fragmentos = None
+            if sistema.pool_fragmentos is None:
+                sistema.iniciar_pool_fragmentos(pool.n_processos, len(pool.fragmentos))
+        self._atual = (self._atual[0] + 1, sistema)
+        if pool is not None and sistema is not anterior:
+            anterior.encerrar_pool_fragmentos()
+        print(f"🔄 Índice de recomendação publicado (versão {self._atual[0]})")
+        return self._atual[0]
+    
+    def recarregar(self, construir, em_segundo_plano=True):
+        """
+        Constrói a próxima versão com `construir()` (que retorna um
+        SistemaRecomendacao) e troca pela atual ao terminar
+        """
+        def tarefa():
+            with self._trava_construcao:
+                try:
+                    novo = construir()
+                except Exception as e:
+                    print(f"❌ Erro ao reconstruir índice de recomendação: {e}")
+                    return
+                self._publicar(novo)
+        
+        if not em_segundo_plano:
+            tarefa()
+            return None
+        
+        self._thread = threading.Thread(target=tarefa, name="recarga-indice", daemon=True)
+        self._thread.start()
+        return self._thread
+    
+    def atualizar_precos(self, df_delta):
+        """
+        Aplica atualizar_precos em uma cópia rasa do sistema atual e publica a
+        cópia, para que leituras em andamento nunca vejam arrays misturados
+        """
+        with self._trava_construcao:
+            sistema = self._atual[1]
+            if sistema is None:
+                erro_msg = "❌ Nenhum índice de recomendação publicado"
+                print(erro_msg)
+                return False, erro_msg
+            copia = copy.copy(sistema)
+            copia.pool_fragmentos = None    # O pool é da versão atual; _publicar monta o da cópia
+            if sistema.dados_processados is not None:
+                copia.dados_processados = sistema.dados_processados.copy()
+            sucesso, msg = copia.atualizar_precos(df_delta)
+            if sucesso:
+                self._publicar(copia)
+            return sucesso, msg
+    
+    def treinar_colaborativo(self, clientes, **parametros):
+        """
+        Treina os embeddings colaborativos em uma cópia rasa do sistema atual
+        e publica a cópia (parâmetros de treinar_embeddings_colaborativos)
+        """
+        with self._trava_construcao:
+            sistema = self._atual[1]
+            if sistema is None or sistema.codigos_categorias is None:
+                erro_msg = "❌ Nenhum índice de recomendação publicado"
+                print(erro_msg)
+                return False, erro_msg
+            copia = copy.copy(sistema)
+            copia.pool_fragmentos = None    # O pool é da versão atual; _publicar monta o da cópia
+            if not copia.treinar_embeddings_colaborativos(clientes, **parametros):
+                return False, "⚠️ Embeddings colaborativos não treinados"
+            versao = self._publicar(copia)
+            return True, f"✅ Embeddings colaborativos publicados (versão {versao})"
+    
+    def aguardar(self, timeout=None):
+        """Espera a recarga em segundo plano terminar (se houver)"""
+        if self._thread is not None:
+            self._thread.join(timeout)
 
 class AlphaVantageProcessor:
     """
@@ -757,17 +3103,33 @@ class AlphaVantageProcessor:
 class SistemaInvestimentos:
     """Sistema principal unificado de recomendações e análise"""
     
-    def __init__(self, caminho_dados_nasdaq=None):
+    # Segundos sem uso até uma sessão de paginação expirar
+    VALIDADE_SESSAO = 300
+    # Cache de resultados de gerar_recomendacoes: itens e segundos de validade
+    CAPACIDADE_CACHE_RECOMENDACOES = 4096
+    VALIDADE_CACHE_RECOMENDACOES = 600
+    
+    def __init__(self, caminho_dados_nasdaq=None, modo_recomendacao='esparso',
+                 diretorio_snapshot="./dados_investimentos/snapshots", compacto=False,
+                 diretorio_cache_dados="./dados_investimentos/cache_dados"):
         self.clientes = []
-        self.sistema_recomendacao = None
+        self.indice_recomendacao = IndiceVersionado()
+        self.modo_recomendacao = modo_recomendacao
+        self.compacto = compacto
+        self.relatorio_rejeitados = None        # Valores rejeitados na última leitura do screener
+        self.diretorio_snapshot = diretorio_snapshot
+        self.diretorio_cache_dados = diretorio_cache_dados
         self.processor = AlphaVantageProcessor()
+        self.sessoes_recomendacao = {}          # token -> CursorRecomendacoes
+        self._trava_sessoes = threading.Lock()
+        self.cache_recomendacoes = CacheLRU(self.CAPACIDADE_CACHE_RECOMENDACOES,
+                                            self.VALIDADE_CACHE_RECOMENDACOES)
         
-        # Carregar dados da NASDAQ ou usar exemplo
-        if caminho_dados_nasdaq and os.path.exists(caminho_dados_nasdaq):
+        # Carregar dados da NASDAQ (ou de vários screeners: lista ou {bolsa: caminho}) ou usar exemplo
+        if caminho_dados_nasdaq and self._screeners_existem(caminho_dados_nasdaq):
             print(f"📂 Carregando dados da NASDAQ de {caminho_dados_nasdaq}...")
             try:
-                self.dados_nasdaq = pd.read_csv(caminho_dados_nasdaq)
-                self.sistema_recomendacao = SistemaRecomendacao(self.dados_nasdaq)
+                self.sistema_recomendacao = self._carregar_sistema_recomendacao(caminho_dados_nasdaq)
                 print("✅ Dados da NASDAQ carregados com sucesso!")
             except Exception as e:
                 print(f"❌ Erro ao carregar dados da NASDAQ: {e}")
@@ -776,6 +3138,14 @@ class SistemaInvestimentos:
             print("📋 Usando dados de exemplo para demonstração...")
             self._criar_dados_exemplo()
     
+    @staticmethod
+    def _screeners_existem(caminhos):
+        """Se o screener (ou todos os screeners da lista/dict) existe em disco"""
+        if isinstance(caminhos, str):
+            return os.path.exists(caminhos)
+        caminhos = list(caminhos.values()) if isinstance(caminhos, dict) else list(caminhos)
+        return bool(caminhos) and all(os.path.exists(caminho) for caminho in caminhos)
+    
     def _criar_dados_exemplo(self):
         """Cria dados de exemplo para demonstração"""
         dados_exemplo = {
@@ -794,9 +3164,73 @@ class SistemaInvestimentos:
             'LS': [150.0, 330.0, 2800.0, 3400.0, 850.0, 200.0, 160.0, 170.0, 230.0, 150.0]
         }
         self.dados_nasdaq = pd.DataFrame(dados_exemplo)
-        self.sistema_recomendacao = SistemaRecomendacao(self.dados_nasdaq)
+        self.sistema_recomendacao = SistemaRecomendacao(self.dados_nasdaq, self.modo_recomendacao, self.compacto)
         print("✅ Dados de exemplo criados com sucesso!")
     
+    def _carregar_sistema_recomendacao(self, caminho_dados_nasdaq):
+        """
+        Usa o snapshot do índice quando existir para o conteúdo atual do CSV;
+        senão constrói o índice a partir do cache dos dados pré-processados (ou,
+        sem cache, lendo o CSV) e salva cache e snapshot para as próximas cargas
+        """
+        if self.diretorio_snapshot:
+            sistema = SistemaRecomendacao.carregar_snapshot(self.diretorio_snapshot, caminho_dados_nasdaq,
+                                                            self.modo_recomendacao, self.compacto)
+            if sistema is not None:
+                self.dados_nasdaq = None
+                self.relatorio_rejeitados = SistemaRecomendacao.carregar_relatorio_cache(
+                    self.diretorio_cache_dados, caminho_dados_nasdaq)
+                return sistema
+        
+        cache = None
+        if self.diretorio_cache_dados:
+            cache = SistemaRecomendacao.carregar_cache_dados(self.diretorio_cache_dados, caminho_dados_nasdaq)
+        if cache is not None:
+            dados_processados, self.relatorio_rejeitados = cache
+            self.dados_nasdaq = None
+            sistema = SistemaRecomendacao(None, self.modo_recomendacao, self.compacto,
+                                          dados_processados=dados_processados)
+        else:
+            self.dados_nasdaq, self.relatorio_rejeitados = carregar_screeners(caminho_dados_nasdaq)
+            # Cache salvo antes do índice: o modo compacto converte os dados depois
+            dados_processados = SistemaRecomendacao.preprocessar(self.dados_nasdaq)
+            if self.diretorio_cache_dados:
+                SistemaRecomendacao.salvar_cache_dados(dados_processados, self.diretorio_cache_dados,
+                                                       caminho_dados_nasdaq, self.relatorio_rejeitados)
+            sistema = SistemaRecomendacao(self.dados_nasdaq, self.modo_recomendacao, self.compacto,
+                                          dados_processados=dados_processados)
+        if self.diretorio_snapshot:
+            sistema.salvar_snapshot(self.diretorio_snapshot, caminho_dados_nasdaq)
+        return sistema
+    
+    @property
+    def sistema_recomendacao(self):
+        """Versão vigente do sistema de recomendação"""
+        return self.indice_recomendacao.sistema
+    
+    @sistema_recomendacao.setter
+    def sistema_recomendacao(self, sistema):
+        self.indice_recomendacao.publicar(sistema)
+    
+    def recarregar_screener(self, caminho_dados_nasdaq, em_segundo_plano=True):
+        """
+        Recarrega o screener sem parar o bot: o novo índice é construído em
+        segundo plano e só então substitui o atual
+        """
+        if not self._screeners_existem(caminho_dados_nasdaq):
+            erro_msg = f"❌ Arquivo não encontrado: {caminho_dados_nasdaq}"
+            print(erro_msg)
+            return False, erro_msg
+        
+        def construir():
+            print(f"📂 Recarregando dados da NASDAQ de {caminho_dados_nasdaq}...")
+            return self._carregar_sistema_recomendacao(caminho_dados_nasdaq)
+        
+        self.indice_recomendacao.recarregar(construir, em_segundo_plano)
+        msg = "🔄 Recarga do screener iniciada" if em_segundo_plano else "✅ Screener recarregado"
+        print(msg)
+        return True, msg
+    
     def cadastrar_cliente(self, id, nome, perfil, tickers, quantidades):
         """Cadastra um novo cliente no sistema"""
         carteira = Carteira(tickers, quantidades)
@@ -805,6 +3239,10 @@ class SistemaInvestimentos:
         print(f"✅ Cliente {nome} cadastrado com sucesso!")
         return cliente
     
+    def treinar_embeddings_colaborativos(self, **parametros):
+        """Treina os embeddings colaborativos com as carteiras dos clientes cadastrados"""
+        return self.indice_recomendacao.treinar_colaborativo(self.clientes, **parametros)
+    
     def mostrar_clientes(self):
         """Exibe todos os clientes cadastrados e retorna como string"""
         buffer = f"\n👥 CLIENTES CADASTRADOS ({len(self.clientes)})\n" + "=" * 50 + "\n"
@@ -815,28 +3253,144 @@ class SistemaInvestimentos:
         
         return buffer
     
-    def gerar_recomendacoes(self, cliente_id, top_n=5):
-        """Gera recomendações para um cliente específico"""
+    def gerar_recomendacoes(self, cliente_id, top_n=5, filtros=None):
+        """Gera recomendações para um cliente específico (memorizadas por versão do índice e pedido)"""
         cliente = next((c for c in self.clientes if c.id == cliente_id), None)
         if not cliente:
             erro_msg = f"❌ Cliente {cliente_id} não encontrado"
             print(erro_msg)
             return None, erro_msg
         
-        if not self.sistema_recomendacao:
+        # Uma única leitura: a requisição inteira usa a mesma versão do índice
+        versao, sistema_recomendacao = self.indice_recomendacao.atual()
+        if not sistema_recomendacao:
             erro_msg = "❌ Sistema de recomendação não disponível"
             print(erro_msg)
             return None, erro_msg
         
-        # Gerar recomendações
-        buffer_recomendacoes, recomendacoes = self.sistema_recomendacao.recomendar_acoes(cliente, top_n)
+        # Versão nova invalida as entradas antigas sem limpar o cache; a geração cobre
+        # alterações feitas no lugar, que não publicam versão nova
+        chave = (versao, sistema_recomendacao.geracao, self._impressao_digital(cliente, top_n, filtros))
+        memorizado = self.cache_recomendacoes.obter(chave)
+        if memorizado is None:
+            # Gerar recomendações
+            memorizado = sistema_recomendacao.recomendar_acoes(cliente, top_n, filtros=filtros)
+            self.cache_recomendacoes.guardar(chave, memorizado)
+        buffer_recomendacoes, recomendacoes, scores = memorizado
         
         return {
             'cliente': cliente,
-            'recomendacoes': recomendacoes,
+            'recomendacoes': list(recomendacoes),
+            'scores': list(scores),
             'buffer': buffer_recomendacoes
         }, buffer_recomendacoes
     
+    @staticmethod
+    def _impressao_digital(cliente, top_n, filtros):
+        """Hash do que determina o resultado de gerar_recomendacoes (o nome entra por causa do buffer)"""
+        conteudo = json.dumps([cliente.id, cliente.nome, cliente.perfil, cliente.carteira.tickers,
+                               cliente.carteira.quantidades, top_n, filtros], sort_keys=True, default=str)
+        return hashlib.blake2b(conteudo.encode('utf-8'), digest_size=16).digest()
+    
+    def _limpar_sessoes(self):
+        """Descarta as sessões de paginação expiradas"""
+        agora = time.time()
+        with self._trava_sessoes:
+            for token in [t for t, cursor in self.sessoes_recomendacao.items() if cursor.expirado(agora)]:
+                del self.sessoes_recomendacao[token]
+    
+    def abrir_sessao_recomendacoes(self, cliente_id, tamanho_pagina=5, filtros=None):
+        """
+        Pontua as recomendações do cliente uma vez e abre uma sessão de
+        paginação; as próximas páginas ("mais") vêm de proxima_pagina_recomendacoes
+        com o token retornado, sem pontuar de novo
+        """
+        self._limpar_sessoes()
+        cliente = next((c for c in self.clientes if c.id == cliente_id), None)
+        if not cliente:
+            erro_msg = f"❌ Cliente {cliente_id} não encontrado"
+            print(erro_msg)
+            return None, erro_msg
+        
+        sistema_recomendacao = self.sistema_recomendacao
+        if not sistema_recomendacao:
+            erro_msg = "❌ Sistema de recomendação não disponível"
+            print(erro_msg)
+            return None, erro_msg
+        
+        buffer, cursor = sistema_recomendacao.cursor_recomendacoes(
+            cliente, filtros=filtros, validade=self.VALIDADE_SESSAO)
+        if cursor is None:
+            return None, buffer
+        
+        token = secrets.token_urlsafe(8)
+        with self._trava_sessoes:
+            self.sessoes_recomendacao[token] = cursor
+        
+        recomendacoes, scores = cursor.proximos(tamanho_pagina)
+        return {
+            'cliente': cliente,
+            'token': token,
+            'recomendacoes': recomendacoes,
+            'scores': scores,
+            'restantes': cursor.restantes(),
+            'buffer': buffer
+        }, buffer
+    
+    def proxima_pagina_recomendacoes(self, token, tamanho_pagina=5):
+        """Próxima página de uma sessão aberta com abrir_sessao_recomendacoes"""
+        self._limpar_sessoes()
+        with self._trava_sessoes:
+            cursor = self.sessoes_recomendacao.get(token)
+        if cursor is None:
+            erro_msg = "⚠️ Sessão de recomendações expirada ou inexistente"
+            print(erro_msg)
+            return None, erro_msg
+        
+        recomendacoes, scores = cursor.proximos(tamanho_pagina)
+        if not recomendacoes:
+            with self._trava_sessoes:
+                self.sessoes_recomendacao.pop(token, None)
+            msg = "⚠️ Não há mais recomendações nesta sessão"
+            print(msg)
+            return {'token': token, 'recomendacoes': [], 'scores': [], 'restantes': 0}, msg
+        
+        msg = f"✅ Mais {len(recomendacoes)} recomendações: {recomendacoes}"
+        print(msg)
+        return {
+            'token': token,
+            'recomendacoes': recomendacoes,
+            'scores': scores,
+            'restantes': cursor.restantes()
+        }, msg
+    
+    def gerar_recomendacoes_lote(self, cliente_ids, top_n=5, tamanho_bloco=128):
+        """Gera recomendações para vários clientes em uma única passada de pontuação"""
+        sistema_recomendacao = self.sistema_recomendacao
+        if not sistema_recomendacao:
+            erro_msg = "❌ Sistema de recomendação não disponível"
+            print(erro_msg)
+            return None, erro_msg
+        
+        clientes_por_id = {c.id: c for c in self.clientes}
+        clientes = [clientes_por_id[cid] for cid in cliente_ids if cid in clientes_por_id]
+        nao_encontrados = [cid for cid in cliente_ids if cid not in clientes_por_id]
+        
+        buffer = f"\n🎯 Gerando recomendações em lote para {len(clientes)} clientes...\n"
+        print(buffer.strip())
+        if nao_encontrados:
+            aviso = f"⚠️ Clientes não encontrados: {nao_encontrados}\n"
+            print(aviso.strip())
+            buffer += aviso
+        
+        resultados = sistema_recomendacao.recomendar_lote(clientes, top_n, tamanho_bloco)
+        
+        resumo = f"✅ Recomendações geradas para {len(resultados)} clientes\n"
+        print(resumo.strip())
+        buffer += resumo
+        
+        return resultados, buffer
+    
     # ============ EXECUÇÃO PRINCIPAL E FUNÇÕES DE DEMO ============
 
 # Criar uma instância global do sistema para ser usada pelo bot